@@ -0,0 +1,266 @@
+"""
+Load-tests the BigQuery and ChatGPT agents of this template against the local fakes in fakes.py.
+
+The agents are built on the fakes, registered in place of the default ones, and then looked up and driven through
+AgentRegistry the way `pyflyte serve agent` does. Async agents are created and then polled until they reach a
+terminal phase, sync agents are called once. Task templates are round-tripped through protobuf for every task,
+like the agent service receives them.
+
+For each agent and concurrency level it reports throughput, p50/p99 task latency, event-loop lag and the resident
+memory each in-flight task adds, and writes everything to a JSON file. Pass the JSON of an earlier run as
+--baseline to compare against it:
+
+    python benchmarks/agent_load_test.py --concurrency 1 16 64 256 --output results.json
+    python benchmarks/agent_load_test.py --concurrency 1 16 64 256 --baseline results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import flytekit
+from fakes import FakeBigQueryClientCache, FakeChatGPTClientCache
+from flyteidl.core.execution_pb2 import TaskExecution
+from flytekit import FlyteContextManager, StructuredDataset, kwtypes, logger
+from flytekit.configuration import ImageConfig, SerializationSettings
+from flytekit.core.type_engine import TypeEngine
+from flytekit.extend.backend.base_agent import AgentRegistry, AsyncAgentBase
+from flytekit.extend.backend.utils import is_terminal_phase
+from flytekit.models.task import TaskTemplate
+from flytekit.tools.translator import get_serializable
+from flytekitplugins.bigquery import BigQueryAgent, BigQueryConfig, BigQueryTask
+from flytekitplugins.openai import ChatGPTAgent, ChatGPTTask
+from flytekitplugins.openai.chatgpt.scheduler import ChatGPTScheduler
+
+LAG_SAMPLE_INTERVAL_SECONDS = 0.01
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class LoopMonitor(object):
+    """
+    Samples how late the event loop wakes up a sleeping coroutine, and the peak resident memory of the process.
+    """
+
+    def __init__(self, interval_seconds: float = LAG_SAMPLE_INTERVAL_SECONDS):
+        self._interval_seconds = interval_seconds
+        self.lags: List[float] = []
+        self.peak_rss: Optional[int] = None
+
+    async def run(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self._interval_seconds)
+            self.lags.append(time.perf_counter() - started_at - self._interval_seconds)
+            rss = rss_bytes()
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+
+def serialize(task) -> TaskTemplate:
+    settings = SerializationSettings(
+        image_config=ImageConfig.auto_default_image(), project="benchmark", domain="development", version="benchmark"
+    )
+    return get_serializable(OrderedDict(), settings, task).template
+
+
+def build_scenarios(args) -> Dict[str, Dict[str, Any]]:
+    bigquery_backend = FakeBigQueryClientCache(
+        query_seconds=args.bigquery_query_seconds, api_latency_seconds=args.bigquery_api_latency_seconds
+    )
+    openai_backend = FakeChatGPTClientCache(
+        time_to_first_token_seconds=args.openai_time_to_first_token_seconds,
+        tokens_per_second=args.openai_tokens_per_second,
+        completion_tokens=args.openai_completion_tokens,
+    )
+    AgentRegistry.register(BigQueryAgent(client_cache=bigquery_backend), override=True)
+    AgentRegistry.register(
+        ChatGPTAgent(
+            client_cache=openai_backend,
+            scheduler=ChatGPTScheduler(requests_per_minute=args.openai_requests_per_minute, tokens_per_minute=10**12),
+        ),
+        override=True,
+    )
+
+    bigquery_task = BigQueryTask(
+        name="benchmark.bigquery",
+        inputs=kwtypes(id=int),
+        query_template="SELECT * FROM `benchmark.dataset.table` WHERE id = @id",
+        task_config=BigQueryConfig(ProjectID="benchmark", Location="US"),
+        output_structured_dataset_type=StructuredDataset,
+    )
+    chatgpt_task = ChatGPTTask(
+        name="benchmark.chatgpt",
+        openai_organization="org-benchmark",
+        # a temperature above 0 keeps the agent's response cache out of the measurement
+        chatgpt_config={"model": "gpt-3.5-turbo", "temperature": 0.7},
+        stream=args.openai_stream,
+    )
+    return {
+        "bigquery": {
+            "template": serialize(bigquery_task),
+            "inputs": lambda i: {"id": i},
+            "types": {"id": int},
+            "backend": bigquery_backend,
+        },
+        "chatgpt": {
+            "template": serialize(chatgpt_task),
+            "inputs": lambda i: {"message": f"Summarize document number {i} in one sentence."},
+            "types": {"message": str},
+            "backend": openai_backend,
+        },
+    }
+
+
+async def run_task(template: TaskTemplate, inputs, poll_interval_seconds: float) -> bool:
+    # the agent service gets a freshly deserialized template with every request
+    template = TaskTemplate.from_flyte_idl(template.to_flyte_idl())
+    agent = AgentRegistry.get_agent(template.type, template.task_type_version)
+    if not isinstance(agent, AsyncAgentBase):
+        resource = await agent.do(template, inputs)
+        return resource.phase == TaskExecution.SUCCEEDED
+
+    resource_meta = await agent.create(template, inputs)
+    while True:
+        resource = await agent.get(resource_meta)
+        if is_terminal_phase(resource.phase):
+            return resource.phase == TaskExecution.SUCCEEDED
+        await asyncio.sleep(poll_interval_seconds)
+
+
+async def run_level(scenario: Dict[str, Any], concurrency: int, tasks: int, poll_interval_seconds: float):
+    ctx = FlyteContextManager.current_context()
+    inputs = [TypeEngine.dict_to_literal_map(ctx, scenario["inputs"](i), scenario["types"]) for i in range(tasks)]
+    backend = scenario["backend"]
+    calls_before = backend.stats()
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(literal_map):
+        nonlocal failures
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                succeeded = await run_task(scenario["template"], literal_map, poll_interval_seconds)
+            except Exception as e:
+                logger.warning(f"Benchmark task failed with {e!r}")
+                succeeded = False
+            latencies.append(time.perf_counter() - started_at)
+            failures += not succeeded
+
+    monitor = LoopMonitor()
+    rss_before = rss_bytes()
+    monitor_task = asyncio.ensure_future(monitor.run())
+    started_at = time.perf_counter()
+    await asyncio.gather(*(one(literal_map) for literal_map in inputs))
+    duration = time.perf_counter() - started_at
+    monitor_task.cancel()
+
+    calls = {k: v - calls_before.get(k, 0) for k, v in backend.stats().items()}
+    rss_per_task = None
+    if rss_before is not None and monitor.peak_rss is not None:
+        rss_per_task = max(0, monitor.peak_rss - rss_before) / min(concurrency, tasks)
+    return {
+        "concurrency": concurrency,
+        "tasks": tasks,
+        "failures": failures,
+        "duration_seconds": duration,
+        "throughput_tasks_per_second": tasks / duration,
+        "latency_p50_seconds": percentile(latencies, 0.5),
+        "latency_p99_seconds": percentile(latencies, 0.99),
+        "loop_lag_p50_ms": (percentile(monitor.lags, 0.5) or 0) * 1000,
+        "loop_lag_p99_ms": (percentile(monitor.lags, 0.99) or 0) * 1000,
+        "loop_lag_max_ms": max(monitor.lags, default=0) * 1000,
+        "rss_bytes_per_in_flight_task": rss_per_task,
+        "api_calls": calls,
+        "api_calls_per_task": sum(calls.values()) / tasks,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {(r["agent"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        before = baseline.get((result["agent"], result["concurrency"]))
+        if before is None:
+            continue
+        print(
+            f"{result['agent']:>10} x{result['concurrency']:<5}"
+            f" throughput {result['throughput_tasks_per_second'] / before['throughput_tasks_per_second']:6.2f}x"
+            f"  p99 {result['latency_p99_seconds'] / before['latency_p99_seconds']:6.2f}x"
+            f"  loop lag p99 {result['loop_lag_p99_ms'] - before['loop_lag_p99_ms']:+8.2f}ms"
+        )
+
+
+async def main(args):
+    scenarios = build_scenarios(args)
+    results = []
+    for name in args.agents:
+        for concurrency in args.concurrency:
+            tasks = max(args.tasks, concurrency)
+            result = await run_level(scenarios[name], concurrency, tasks, args.poll_interval_seconds)
+            result["agent"] = name
+            results.append(result)
+            print(
+                f"{name:>10} x{concurrency:<5} {result['throughput_tasks_per_second']:8.1f} tasks/s"
+                f"  p50 {result['latency_p50_seconds']:7.3f}s  p99 {result['latency_p99_seconds']:7.3f}s"
+                f"  loop lag p99 {result['loop_lag_p99_ms']:7.2f}ms"
+                f"  failures {result['failures']}"
+            )
+
+    report = {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "flytekit": flytekit.__version__,
+            "arguments": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", nargs="+", choices=["bigquery", "chatgpt"], default=["bigquery", "chatgpt"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 16, 64, 256])
+    parser.add_argument("--tasks", type=int, default=256, help="Tasks per concurrency level, at least the concurrency")
+    parser.add_argument("--poll_interval_seconds", type=float, default=1, help="Interval between gets of async agents")
+    parser.add_argument("--output", default="agent_benchmark.json")
+    parser.add_argument("--baseline", help="JSON written by an earlier run to compare against")
+    parser.add_argument("--bigquery_query_seconds", type=float, default=2)
+    parser.add_argument("--bigquery_api_latency_seconds", type=float, default=0.05)
+    parser.add_argument("--openai_time_to_first_token_seconds", type=float, default=0.3)
+    parser.add_argument("--openai_tokens_per_second", type=float, default=100)
+    parser.add_argument("--openai_completion_tokens", type=int, default=50)
+    parser.add_argument("--openai_requests_per_minute", type=int, default=10**6)
+    parser.add_argument("--openai_stream", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
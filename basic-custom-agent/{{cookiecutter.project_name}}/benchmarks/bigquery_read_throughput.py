@@ -0,0 +1,105 @@
+"""
+Compares the two ways of reading the results of a BigQueryTask, against FakeBigQueryReadClient in fakes.py:
+
+- whole: what the pandas decoder does, every read stream is read into a DataFrame and the frames are concatenated
+- streaming: read_record_batches, which hands out Arrow record batches as they arrive from parallel streams
+
+For each it reports rows/s and the peak resident memory. Every decoder runs in a process of its own, so the peak
+memory is its own. Run it where flytekit and the bigquery plugin are installed:
+
+    python benchmarks/bigquery_read_throughput.py --rows 5000000 --streams 4 --output read_throughput.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import re
+import resource
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from fakes import FakeBigQueryReadClient
+from flytekitplugins.bigquery.sd_transformers import read_record_batches
+from google.cloud.bigquery_storage_v1 import types
+
+URI = "bq://flyte-benchmark:dataset.results"
+
+
+def read_whole(read_client: FakeBigQueryReadClient, args) -> int:
+    _, project_id, dataset_id, table_id = re.split("\\.|://|:", URI)
+    requested_session = types.ReadSession(
+        table=f"projects/{project_id}/datasets/{dataset_id}/tables/{table_id}", data_format=types.DataFormat.ARROW
+    )
+    read_session = read_client.create_read_session(parent=f"projects/{project_id}", read_session=requested_session)
+    frames = [read_client.read_rows(stream.name).to_dataframe(read_session) for stream in read_session.streams]
+    return len(pd.concat(frames))
+
+
+def read_streaming(read_client: FakeBigQueryReadClient, args) -> int:
+    batches = read_record_batches(
+        read_client, URI, max_streams=args.streams, max_queued_batches=args.max_queued_batches
+    )
+    return sum(batch.num_rows for batch in batches)
+
+
+DECODERS = OrderedDict(whole=read_whole, streaming=read_streaming)
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(decoder: str, args) -> dict:
+    read_client = FakeBigQueryReadClient(
+        rows=args.rows,
+        streams=args.streams,
+        rows_per_page=args.rows_per_page,
+        page_latency_seconds=args.page_latency_seconds,
+    )
+    rss_before = peak_rss_bytes()
+    started_at = time.perf_counter()
+    rows = DECODERS[decoder](read_client, args)
+    duration = time.perf_counter() - started_at
+    peak_rss = peak_rss_bytes()
+    return {
+        "decoder": decoder,
+        "rows": rows,
+        "duration_seconds": duration,
+        "rows_per_second": rows / duration,
+        "peak_rss_bytes": peak_rss,
+        "peak_rss_bytes_added": peak_rss - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--decoders", nargs="+", choices=list(DECODERS), default=list(DECODERS))
+    parser.add_argument("--rows", type=int, default=5 * 10**6)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--rows_per_page", type=int, default=10**4)
+    parser.add_argument("--page_latency_seconds", type=float, default=0.005)
+    parser.add_argument("--max_queued_batches", type=int, default=8)
+    parser.add_argument("--output", default="bigquery_read_throughput.json")
+    args = parser.parse_args()
+
+    results = []
+    for decoder in args.decoders:
+        # a fresh process for every decoder, since the peak resident memory of a process never goes down
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(run, decoder, args).result()
+        results.append(result)
+        print(
+            f"{decoder:>10}: {result['rows_per_second']:12,.0f} rows/s"
+            f"  peak RSS {result['peak_rss_bytes'] / 2**20:8.1f} MiB"
+            f" (+{result['peak_rss_bytes_added'] / 2**20:.1f} MiB while reading)"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
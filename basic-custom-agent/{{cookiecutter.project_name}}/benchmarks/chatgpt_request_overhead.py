@@ -0,0 +1,79 @@
+"""
+Measures the per-call work ChatGPTAgent.do does before a request is sent: reading the task template, building the
+request arguments, estimating tokens and computing the response cache key.
+
+It compares the cached ChatGPTRequestPrototype against re-reading ``task_template.custom`` on every call, as the
+agent used to. Run it where flytekit and the openai plugin are installed:
+
+    python benchmarks/chatgpt_request_overhead.py --iterations 100000
+"""
+
+import argparse
+import hashlib
+import json
+import timeit
+from types import SimpleNamespace
+
+from flytekit.models.core.identifier import Identifier, ResourceType
+from flytekitplugins.openai.chatgpt.request import ChatGPTRequestPrototypeCache
+
+CUSTOM = {
+    "openai_organization": "org-NayNG68kGnVXMJ8Ak4PMgQv7",
+    "chatgpt_config": {
+        "model": "gpt-3.5-turbo",
+        "temperature": 0,
+        "max_tokens": 256,
+        "top_p": 1,
+        "presence_penalty": 0,
+        "frequency_penalty": 0,
+        "response_format": {"type": "text"},
+        "logit_bias": {str(token): -100 for token in range(50)},
+    },
+}
+MESSAGE = "Classify the sentiment of this review as positive, negative or neutral. " * 8
+
+
+def per_call_custom(custom, message):
+    # what the agent did on every call: write the message into the shared template and hash the whole config
+    custom["chatgpt_config"]["messages"] = [{"role": "user", "content": message}]
+    config = custom["chatgpt_config"]
+    estimated_tokens = len(message) // 4 + int(config.get("max_tokens") or 512)
+    key = {"organization": custom["openai_organization"], "chatgpt_config": config, "message": message}
+    cache_key = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+    return dict(**config), estimated_tokens, cache_key
+
+
+def cached_prototype(prototypes, task_template, message):
+    prototype = prototypes.get(task_template)
+    request = dict(**prototype.chatgpt_config, messages=prototype.messages(message))
+    return request, prototype.estimated_tokens(message), prototype.cache_key(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # the prototype cache only reads the template's id and custom
+    task_template = SimpleNamespace(
+        id=Identifier(ResourceType.TASK, "flytesnacks", "development", "chatgpt", "v1"),
+        custom=json.loads(json.dumps(CUSTOM)),
+    )
+    prototypes = ChatGPTRequestPrototypeCache()
+    custom = json.loads(json.dumps(CUSTOM))
+
+    cases = {
+        "per-call custom": lambda: per_call_custom(custom, MESSAGE),
+        "cached prototype": lambda: cached_prototype(prototypes, task_template, MESSAGE),
+    }
+    results = {}
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=args.iterations, repeat=args.repeat))
+        results[name] = best / args.iterations * 1e6
+        print(f"{name:>20}: {results[name]:8.2f} us/call")
+    print(f"{'speedup':>20}: {results['per-call custom'] / results['cached prototype']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Local stand-ins for the BigQuery and OpenAI clients the agents call, with configurable latencies. They implement
+only the calls the agents make, and are passed to the agents through their client_cache parameters. The BigQuery
+Storage read client is passed to the result decoders instead.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Optional
+
+import pyarrow as pa
+
+class FakeQueryJob(object):
+    def __init__(self, job_id: str, project: str, location: str, done_at: float, total_bytes_processed: int):
+        self.job_id = job_id
+        self.project = project
+        self.location = location
+        self.total_bytes_processed = total_bytes_processed
+        self.errors = None
+        self.destination = SimpleNamespace(project=project, dataset_id="_benchmark", table_id=f"anon_{job_id}")
+        self.created_at = time.monotonic()
+        self._done_at = done_at
+        self._cancelled = False
+
+    @property
+    def state(self) -> str:
+        return "DONE" if self._cancelled or time.monotonic() >= self._done_at else "RUNNING"
+
+    def cancel(self):
+        self._cancelled = True
+
+
+class FakeBigQueryClient(object):
+    """
+    Blocks for ``api_latency_seconds`` on every call, like the real client blocks on HTTP requests. Jobs finish
+    ``query_seconds`` after they are created.
+    """
+
+    def __init__(self, backend: "FakeBigQueryClientCache", project: str, location: str):
+        self._backend = backend
+        self._project = project
+        self._location = location
+
+    def _call(self, method: str):
+        self._backend.calls[method] += 1
+        time.sleep(self._backend.api_latency_seconds)
+
+    def query(self, statement: str, job_config=None) -> FakeQueryJob:
+        self._call("query")
+        if getattr(job_config, "dry_run", False):
+            return FakeQueryJob("", self._project, self._location, 0, self._backend.bytes_processed)
+        job_id = f"benchmark_{next(self._backend.job_ids)}"
+        job = FakeQueryJob(
+            job_id,
+            self._project,
+            self._location,
+            time.monotonic() + self._backend.query_seconds,
+            self._backend.bytes_processed,
+        )
+        with self._backend.lock:
+            self._backend.jobs[job_id] = job
+        return job
+
+    def get_job(self, job_id: str, project: Optional[str] = None, location: Optional[str] = None) -> FakeQueryJob:
+        self._call("get_job")
+        with self._backend.lock:
+            return self._backend.jobs[job_id]
+
+    def list_jobs(self, project: Optional[str] = None, min_creation_time=None, max_results: Optional[int] = None):
+        self._call("list_jobs")
+        # every job of the run is recent, so min_creation_time does not filter anything out
+        with self._backend.lock:
+            jobs = [job for job in self._backend.jobs.values() if job.project == (project or self._project)]
+        # newest first, like jobs.list
+        jobs.sort(key=lambda job: job.created_at, reverse=True)
+        return jobs[:max_results]
+
+    def cancel_job(self, job_id: str, project: Optional[str] = None, location: Optional[str] = None):
+        self._call("cancel_job")
+        with self._backend.lock:
+            self._backend.jobs[job_id].cancel()
+
+    def close(self):
+        pass
+
+
+class FakeBigQueryClientCache(object):
+    """
+    A drop-in for BigQueryClientCache whose clients share one in-memory set of jobs and count the calls made.
+    """
+
+    def __init__(self, query_seconds: float = 2, api_latency_seconds: float = 0.05, bytes_processed: int = 10**9):
+        self.query_seconds = query_seconds
+        self.api_latency_seconds = api_latency_seconds
+        self.bytes_processed = bytes_processed
+        self.jobs = {}
+        self.calls = Counter()
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def get(self, project: Optional[str], location: Optional[str]) -> FakeBigQueryClient:
+        return FakeBigQueryClient(self, project, location)
+
+    def stats(self):
+        return dict(self.calls)
+
+
+class _FakeReadRowsPage(object):
+    def __init__(self, batch: pa.RecordBatch):
+        self._batch = batch
+
+    def to_arrow(self) -> pa.RecordBatch:
+        return self._batch
+
+
+class FakeReadRowsStream(object):
+    """
+    One read stream of a FakeBigQueryReadClient session, read page by page or as a whole like ReadRowsStream.
+    """
+
+    def __init__(self, client: "FakeBigQueryReadClient", rows: int):
+        self._client = client
+        self._rows = rows
+
+    def _pages(self):
+        for offset in range(0, self._rows, self._client.rows_per_page):
+            time.sleep(self._client.page_latency_seconds)
+            yield _FakeReadRowsPage(self._client.page(min(self._client.rows_per_page, self._rows - offset)))
+
+    def rows(self, read_session=None) -> SimpleNamespace:
+        return SimpleNamespace(pages=self._pages())
+
+    def to_arrow(self, read_session=None) -> pa.Table:
+        return pa.Table.from_batches([page.to_arrow() for page in self._pages()])
+
+    def to_dataframe(self, read_session=None):
+        return self.to_arrow(read_session).to_pandas()
+
+
+class FakeBigQueryReadClient(object):
+    """
+    Serves a table of ``rows`` rows split evenly over ``streams`` read streams, in pages of ``rows_per_page`` rows
+    that each take ``page_latency_seconds`` to arrive. Every page is a fresh copy, so whatever a reader keeps of them
+    shows up in its memory.
+    """
+
+    def __init__(
+        self, rows: int = 10**6, streams: int = 4, rows_per_page: int = 10**4, page_latency_seconds: float = 0.005
+    ):
+        self.rows = rows
+        self.streams = streams
+        self.rows_per_page = rows_per_page
+        self.page_latency_seconds = page_latency_seconds
+        self.calls = Counter()
+        ids = pa.array(range(rows_per_page), pa.int64())
+        self._template = pa.RecordBatch.from_arrays(
+            [ids, ids.cast(pa.float64()), ids.cast(pa.string())], names=["id", "value", "name"]
+        )
+        self._indices = ids
+        self._stream_rows = {}
+
+    def page(self, rows: int) -> pa.RecordBatch:
+        # take copies the buffers instead of slicing the template
+        return self._template.take(self._indices.slice(0, rows))
+
+    def create_read_session(self, parent: str, read_session, max_stream_count: int = 0) -> SimpleNamespace:
+        self.calls["create_read_session"] += 1
+        streams = min(self.streams, max_stream_count) if max_stream_count else self.streams
+        names = [f"{parent}/streams/{len(self._stream_rows) + i}" for i in range(streams)]
+        for i, name in enumerate(names):
+            self._stream_rows[name] = self.rows // streams + (i < self.rows % streams)
+        return SimpleNamespace(streams=[SimpleNamespace(name=name) for name in names])
+
+    def read_rows(self, name: str) -> FakeReadRowsStream:
+        self.calls["read_rows"] += 1
+        return FakeReadRowsStream(self, self._stream_rows[name])
+
+    def stats(self):
+        return dict(self.calls)
+
+
+class _FakeCompletionStream(object):
+    def __init__(self, client: "FakeAsyncOpenAI", completion_tokens: int, prompt_tokens: int):
+        self._client = client
+        self._completion_tokens = completion_tokens
+        self._prompt_tokens = prompt_tokens
+        self._sent = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._sent > self._completion_tokens:
+            raise StopAsyncIteration
+        self._sent += 1
+        if self._sent > self._completion_tokens:
+            # the last chunk only reports usage, as with stream_options={"include_usage": True}
+            return SimpleNamespace(choices=[], usage=self._client._usage(self._prompt_tokens, self._completion_tokens))
+        await asyncio.sleep(
+            self._client.time_to_first_token_seconds if self._sent == 1 else 1 / self._client.tokens_per_second
+        )
+        delta = SimpleNamespace(content="token ")
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=delta)], usage=None)
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncOpenAI(object):
+    """
+    Answers chat completions after ``time_to_first_token_seconds`` plus ``completion_tokens`` generated at
+    ``tokens_per_second``, without blocking the event loop.
+    """
+
+    def __init__(
+        self, time_to_first_token_seconds: float = 0.3, tokens_per_second: float = 100, completion_tokens: int = 50
+    ):
+        self.time_to_first_token_seconds = time_to_first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.calls = Counter()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    @staticmethod
+    def _usage(prompt_tokens: int, completion_tokens: int):
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    async def _create(self, model: str, messages, stream: bool = False, max_tokens: Optional[int] = None, **kwargs):
+        self.calls["chat.completions.create"] += 1
+        completion_tokens = min(self.completion_tokens, max_tokens or self.completion_tokens)
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        if stream:
+            return _FakeCompletionStream(self, completion_tokens, prompt_tokens)
+        await asyncio.sleep(self.time_to_first_token_seconds + completion_tokens / self.tokens_per_second)
+        message = SimpleNamespace(content="token " * completion_tokens)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=0, message=message)], usage=self._usage(prompt_tokens, completion_tokens)
+        )
+
+
+class FakeChatGPTClientCache(object):
+    """
+    A drop-in for ChatGPTClientCache that hands out one FakeAsyncOpenAI for every organization.
+    """
+
+    def __init__(self, **kwargs):
+        self.client = FakeAsyncOpenAI(**kwargs)
+
+    def get(self, organization: Optional[str]) -> FakeAsyncOpenAI:
+        return self.client
+
+    def stats(self):
+        return dict(self.client.calls)
@@ -0,0 +1,15 @@
+"""
+.. currentmodule:: flytekitplugins.agentmetrics
+
+This package contains the Prometheus instrumentation shared by the custom agents.
+
+.. autosummary::
+   :template: custom.rst
+   :toctree: generated/
+
+   InstrumentedAgentMixin
+   external_call
+   record_client_cache_lookup
+"""
+
+from .instrumentation import InstrumentedAgentMixin, external_call, record_client_cache_lookup
@@ -0,0 +1,134 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+
+from flyteidl.core.execution_pb2 import TaskExecution
+from prometheus_client import Counter, Gauge, Histogram
+
+# Methods of AsyncAgentBase and SyncAgentBase that talk to the external service
+AGENT_METHODS = ("create", "get", "delete", "do")
+FAILED_PHASES = (TaskExecution.FAILED, TaskExecution.ABORTED)
+
+# The agent service records request counts and latencies per gRPC call, these are measured inside the agent, so they
+# also cover local executions, and break the time down by external API call.
+agent_method_latency = Histogram(
+    "flyte_agent_method_latency_seconds",
+    "Time spent in an agent's create, get, delete or do method",
+    ["task_type", "method"],
+)
+agent_methods_in_flight = Gauge(
+    "flyte_agent_methods_in_flight",
+    "Agent create, get, delete or do calls that have started and not yet returned",
+    ["task_type", "method"],
+)
+agent_method_errors = Counter(
+    "flyte_agent_method_errors_total",
+    "Agent calls that raised, with phase EXCEPTION, or returned a failed or aborted task phase",
+    ["task_type", "method", "phase"],
+)
+external_calls = Counter(
+    "flyte_agent_external_calls_total",
+    "Calls from an agent to the external service, by outcome",
+    ["task_type", "api", "outcome"],
+)
+external_call_latency = Histogram(
+    "flyte_agent_external_call_latency_seconds",
+    "Time spent in calls from an agent to the external service",
+    ["task_type", "api"],
+)
+client_cache_lookups = Counter(
+    "flyte_agent_client_cache_lookups_total",
+    "Lookups in an agent's cache of API clients, a miss creates a new client",
+    ["client", "outcome"],
+)
+
+
+@contextmanager
+def external_call(task_type: str, api: str):
+    """
+    Counts and times one call to the external service, e.g.
+
+        with external_call("bigquery_query_job_task", "get_job"):
+            client.get_job(job_id)
+    """
+    started_at = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        external_call_latency.labels(task_type=task_type, api=api).observe(time.monotonic() - started_at)
+        external_calls.labels(task_type=task_type, api=api, outcome=outcome).inc()
+
+
+def record_client_cache_lookup(client: str, hit: bool):
+    """
+    Counts one lookup in a cache of clients for the external service, e.g. record_client_cache_lookup("bigquery", True)
+    """
+    client_cache_lookups.labels(client=client, outcome="hit" if hit else "miss").inc()
+
+
+def _record_result(task_type: str, method: str, result):
+    # get and do return a Resource, its phase usually comes from convert_to_flyte_phase
+    phase = getattr(result, "phase", None)
+    if phase in FAILED_PHASES:
+        agent_method_errors.labels(task_type=task_type, method=method, phase=TaskExecution.Phase.Name(phase)).inc()
+
+
+@contextmanager
+def _measure(task_type: str, method: str):
+    in_flight = agent_methods_in_flight.labels(task_type=task_type, method=method)
+    in_flight.inc()
+    started_at = time.monotonic()
+    try:
+        yield
+    except Exception:
+        agent_method_errors.labels(task_type=task_type, method=method, phase="EXCEPTION").inc()
+        raise
+    finally:
+        in_flight.dec()
+        agent_method_latency.labels(task_type=task_type, method=method).observe(time.monotonic() - started_at)
+
+
+def _instrument(method: str, func):
+    # AsyncAgentBase also accepts synchronous create, get and delete, the agent service runs those in a thread
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with _measure(self.task_category.name, method):
+                result = await func(self, *args, **kwargs)
+            _record_result(self.task_category.name, method, result)
+            return result
+
+    else:
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with _measure(self.task_category.name, method):
+                result = func(self, *args, **kwargs)
+            _record_result(self.task_category.name, method, result)
+            return result
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+class InstrumentedAgentMixin(object):
+    """
+    Records Prometheus metrics for the create, get, delete and do methods an agent defines. List it before the agent
+    base class:
+
+        class MyAgent(InstrumentedAgentMixin, AsyncAgentBase):
+            ...
+
+    Calls to the external service are recorded by wrapping them in ``external_call``.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method in AGENT_METHODS:
+            func = cls.__dict__.get(method)
+            if func is not None and not getattr(func, "__instrumented__", False):
+                setattr(cls, method, _instrument(method, func))
@@ -10,7 +10,15 @@ This package contains things that are useful when extending Flytekit.
    BigQueryConfig
    BigQueryTask
    BigQueryAgent
+   BigQueryClientCache
+   BigQueryJobPoller
+   BigQueryResultCache
+   BigQueryToArrowStreamDecodingHandler
 """
 
 from .agent import BigQueryAgent
+from .cache import BigQueryResultCache
+from .client import BigQueryClientCache
+from .poller import BigQueryJobPoller
+from .sd_transformers import BigQueryToArrowStreamDecodingHandler
 from .task import BigQueryConfig, BigQueryTask
@@ -1,27 +1,39 @@
-import datetime
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from flyteidl.core.execution_pb2 import TaskExecution, TaskLog
 from google.cloud import bigquery
+from prometheus_client import Histogram
 
-from flytekit import FlyteContextManager, StructuredDataset, logger
+from flytekit import FlyteContext, FlyteContextManager, StructuredDataset, logger
 from flytekit.core.type_engine import TypeEngine
 from flytekit.extend.backend.base_agent import AgentRegistry, AsyncAgentBase, Resource, ResourceMeta
 from flytekit.extend.backend.utils import convert_to_flyte_phase
 from flytekit.models.literals import LiteralMap
 from flytekit.models.task import TaskTemplate
+from flytekitplugins.agentmetrics import InstrumentedAgentMixin, external_call
 
-pythonTypeToBigQueryType: Dict[type, str] = {
-    # https://cloud.google.com/bigquery/docs/reference/standard-sql/data-types#data_type_sizes
-    list: "ARRAY",
-    bool: "BOOL",
-    bytes: "BYTES",
-    datetime.datetime: "DATETIME",
-    float: "FLOAT64",
-    int: "INT64",
-    str: "STRING",
-}
+from .cache import BigQueryResultCache, is_cacheable_sql, result_cache_key
+from .client import BigQueryClientCache
+from .parameters import QueryParameter, pythonTypeToBigQueryType, to_query_parameter  # noqa: F401
+from .poller import BigQueryJobPoller
+
+# Maximum number of BigQuery API calls the agent runs at the same time, further calls wait for a free worker thread
+MAX_CONCURRENCY = int(os.getenv("FLYTE_BIGQUERY_AGENT_MAX_CONCURRENCY", "32"))
+
+bigquery_estimated_bytes = Histogram(
+    "flyte_agent_bigquery_estimated_bytes_processed",
+    "Bytes a query is estimated to process, from the dry run made before the query job is created",
+    ["project"],
+    buckets=[10**exponent for exponent in range(6, 15)],
+)
+
+# Settings in the task's custom config that are read by the agent itself, rather than describing the query
+AGENT_SETTINGS = ("ResultCacheTTLSeconds", "DryRun")
 
 
 @dataclass
@@ -29,51 +41,169 @@ class BigQueryMetadata(ResourceMeta):
     job_id: str
     project: str
     location: str
-
-
-class BigQueryAgent(AsyncAgentBase):
+    result_cache_key: Optional[str] = None
+    result_cache_ttl_seconds: Optional[int] = None
+    # set instead of a job when the result of an identical earlier query is reused
+    cached_output_location: Optional[str] = None
+    estimated_bytes_processed: Optional[int] = None
+    # set instead of a job when the query was rejected before it ran
+    error_message: Optional[str] = None
+
+
+def format_bytes(num_bytes: int) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if num_bytes < 1000 or unit == "TB":
+            break
+        num_bytes /= 1000
+    return f"{num_bytes:.1f} {unit}"
+
+
+def describe_inputs(native_inputs: Dict[str, Any]) -> str:
+    # list inputs may hold the values of a large IN-filter, so only their size is logged
+    descriptions = []
+    for name, value in native_inputs.items():
+        if isinstance(value, (list, dict)):
+            descriptions.append(f"{name} ({type(value).__name__} of {len(value)})")
+        else:
+            descriptions.append(f"{name} ({type(value).__name__})")
+    return ", ".join(descriptions)
+
+
+class BigQueryAgent(InstrumentedAgentMixin, AsyncAgentBase):
     name = "Bigquery Agent"
 
-    def __init__(self):
+    def __init__(
+        self,
+        client_cache: Optional[BigQueryClientCache] = None,
+        job_poller: Optional[BigQueryJobPoller] = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        result_cache: Optional[BigQueryResultCache] = None,
+    ):
         super().__init__(task_type_name="bigquery_query_job_task", metadata_type=BigQueryMetadata)
-
-    def create(
+        self.client_cache = client_cache or BigQueryClientCache()
+        self.result_cache = result_cache or BigQueryResultCache()
+        # The BigQuery client is blocking, so its calls run on a bounded pool instead of the agent's event loop
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bigquery-agent")
+        self.job_poller = job_poller or BigQueryJobPoller(self.client_cache, run_blocking=self._run_blocking)
+
+    async def _run_in_executor(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _run_blocking(self, operation: str, func: Callable, *args, **kwargs) -> Any:
+        # the recorded latency includes the time spent waiting for a worker thread
+        with external_call(self.task_category.name, operation):
+            return await self._run_in_executor(func, *args, **kwargs)
+
+    def _query(self, project: str, location: str, statement: str, job_config: Optional[bigquery.QueryJobConfig]):
+        client = self.client_cache.get(project, location)
+        return client.query(statement, job_config=job_config)
+
+    def _query_parameters(
+        self, ctx: FlyteContext, task_template: TaskTemplate, inputs: LiteralMap
+    ) -> List[QueryParameter]:
+        python_interface_inputs = {
+            name: TypeEngine.guess_python_type(lt.type) for name, lt in task_template.interface.inputs.items()
+        }
+        native_inputs = TypeEngine.literal_map_to_kwargs(ctx, inputs, python_interface_inputs)
+        logger.info(f"Create BigQuery job config with inputs: {describe_inputs(native_inputs)}")
+        return [to_query_parameter(name, python_interface_inputs[name], val) for name, val in native_inputs.items()]
+
+    def _cancel_job(self, job_id: str, project: str, location: str):
+        client = self.client_cache.get(project, location)
+        client.cancel_job(job_id, project, location)
+
+    async def create(
         self,
         task_template: TaskTemplate,
         inputs: Optional[LiteralMap] = None,
         **kwargs,
     ) -> BigQueryMetadata:
-        job_config = None
+        query_parameters = []
         if inputs:
-            ctx = FlyteContextManager.current_context()
-            python_interface_inputs = {
-                name: TypeEngine.guess_python_type(lt.type) for name, lt in task_template.interface.inputs.items()
-            }
-            native_inputs = TypeEngine.literal_map_to_kwargs(ctx, inputs, python_interface_inputs)
-            logger.info(f"Create BigQuery job config with inputs: {native_inputs}")
-            job_config = bigquery.QueryJobConfig(
-                query_parameters=[
-                    bigquery.ScalarQueryParameter(name, pythonTypeToBigQueryType[python_interface_inputs[name]], val)
-                    for name, val in native_inputs.items()
-                ]
+            # a StructuredDataset input is downloaded from blob storage while its parameter is built, the context is
+            # taken here since the worker thread does not inherit it. It is no call to BigQuery, so it is not recorded
+            # as an external call.
+            query_parameters = await self._run_in_executor(
+                self._query_parameters, FlyteContextManager.current_context(), task_template, inputs
             )
 
         custom = task_template.custom
         project = custom["ProjectID"]
         location = custom["Location"]
-        client = bigquery.Client(project=project, location=location)
-        query_job = client.query(task_template.sql.statement, job_config=job_config)
+        statement = task_template.sql.statement
+        job_config = bigquery.QueryJobConfig(query_parameters=query_parameters)
+        if custom.get("maximumBytesBilled"):
+            job_config.maximum_bytes_billed = int(custom["maximumBytesBilled"])
+
+        cache_key = None
+        cache_ttl_seconds = custom.get("ResultCacheTTLSeconds")
+        if cache_ttl_seconds and is_cacheable_sql(statement):
+            cache_key = result_cache_key(
+                statement, query_parameters, {k: v for k, v in custom.items() if k not in AGENT_SETTINGS}
+            )
+            cached_output_location = self.result_cache.get(cache_key)
+            if cached_output_location:
+                logger.info(f"Reusing the result of an identical BigQuery query: {cached_output_location}")
+                return BigQueryMetadata(
+                    job_id="", location=location, project=project, cached_output_location=cached_output_location
+                )
+
+        estimated_bytes = None
+        if custom.get("DryRun"):
+            dry_run_config = bigquery.QueryJobConfig(
+                dry_run=True, use_query_cache=False, query_parameters=query_parameters
+            )
+            dry_run_job = await self._run_blocking("dry_run", self._query, project, location, statement, dry_run_config)
+            estimated_bytes = dry_run_job.total_bytes_processed or 0
+            bigquery_estimated_bytes.labels(project=project).observe(estimated_bytes)
+            logger.info(f"BigQuery query is estimated to process {format_bytes(estimated_bytes)}")
+            budget = job_config.maximum_bytes_billed
+            if budget is not None and estimated_bytes > budget:
+                message = (
+                    f"Rejected BigQuery query: it is estimated to process {format_bytes(estimated_bytes)}, "
+                    f"which exceeds maximum_bytes_billed of {format_bytes(budget)}"
+                )
+                logger.error(message)
+                return BigQueryMetadata(
+                    job_id="",
+                    location=location,
+                    project=project,
+                    estimated_bytes_processed=estimated_bytes,
+                    error_message=message,
+                )
+
+        query_job = await self._run_blocking("query", self._query, project, location, statement, job_config)
+
+        return BigQueryMetadata(
+            job_id=str(query_job.job_id),
+            location=location,
+            project=project,
+            result_cache_key=cache_key,
+            result_cache_ttl_seconds=int(cache_ttl_seconds) if cache_key else None,
+            estimated_bytes_processed=estimated_bytes,
+        )
 
-        return BigQueryMetadata(job_id=str(query_job.job_id), location=location, project=project)
+    async def get(self, resource_meta: BigQueryMetadata, **kwargs) -> Resource:
+        if resource_meta.cached_output_location:
+            return Resource(
+                phase=TaskExecution.SUCCEEDED,
+                message="DONE (cached result)",
+                outputs={"results": StructuredDataset(uri=resource_meta.cached_output_location)},
+            )
+
+        if resource_meta.error_message:
+            return Resource(phase=TaskExecution.FAILED, message=resource_meta.error_message)
 
-    def get(self, resource_meta: BigQueryMetadata, **kwargs) -> Resource:
-        client = bigquery.Client()
+        log_link_name = "BigQuery Console"
+        if resource_meta.estimated_bytes_processed is not None:
+            log_link_name += f" (estimated {format_bytes(resource_meta.estimated_bytes_processed)} processed)"
         log_link = TaskLog(
             uri=f"https://console.cloud.google.com/bigquery?project={resource_meta.project}&j=bq:{resource_meta.location}:{resource_meta.job_id}&page=queryresults",
-            name="BigQuery Console",
+            name=log_link_name,
         )
 
-        job = client.get_job(resource_meta.job_id, resource_meta.project, resource_meta.location)
+        job = await self.job_poller.get_job(resource_meta.job_id, resource_meta.project, resource_meta.location)
         if job.errors:
             logger.error("failed to run BigQuery job with error:", job.errors.__str__())
             return Resource(phase=TaskExecution.FAILED, message=job.errors.__str__(), log_links=[log_link])
@@ -86,12 +216,20 @@ class BigQueryAgent(AsyncAgentBase):
             if dst:
                 output_location = f"bq://{dst.project}:{dst.dataset_id}.{dst.table_id}"
                 res = {"results": StructuredDataset(uri=output_location)}
+                if resource_meta.result_cache_key:
+                    self.result_cache.put(
+                        resource_meta.result_cache_key, output_location, resource_meta.result_cache_ttl_seconds
+                    )
 
         return Resource(phase=cur_phase, message=str(job.state), log_links=[log_link], outputs=res)
 
-    def delete(self, resource_meta: BigQueryMetadata, **kwargs):
-        client = bigquery.Client()
-        client.cancel_job(resource_meta.job_id, resource_meta.project, resource_meta.location)
+    async def delete(self, resource_meta: BigQueryMetadata, **kwargs):
+        if not resource_meta.job_id:
+            # a reused result or a query rejected by its dry run, no job was created
+            return
+        await self._run_blocking(
+            "cancel_job", self._cancel_job, resource_meta.job_id, resource_meta.project, resource_meta.location
+        )
 
 
 AgentRegistry.register(BigQueryAgent())
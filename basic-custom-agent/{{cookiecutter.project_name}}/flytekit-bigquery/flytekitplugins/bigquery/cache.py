@@ -0,0 +1,79 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from google.cloud import bigquery
+
+# BigQuery deletes the anonymous tables that hold query results after about 24 hours
+MAX_RESULT_CACHE_TTL_SECONDS = 23 * 60 * 60
+
+_NON_DETERMINISTIC_SQL = re.compile(
+    r"\b(CURRENT_(DATE|DATETIME|TIME|TIMESTAMP)|NOW|RAND|GENERATE_UUID|SESSION_USER)\s*\(",
+    re.IGNORECASE,
+)
+_READ_ONLY_SQL = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def normalize_sql(statement: str) -> str:
+    return " ".join(statement.split()).rstrip(";").strip()
+
+
+def is_cacheable_sql(statement: str) -> bool:
+    """
+    Only read-only queries that do not depend on the time or on randomness return the same result for the same inputs.
+    """
+    return bool(_READ_ONLY_SQL.match(statement)) and not _NON_DETERMINISTIC_SQL.search(statement)
+
+
+def result_cache_key(
+    statement: str, query_parameters: List[bigquery.ScalarQueryParameter], custom: Dict[str, Any]
+) -> str:
+    """
+    Builds the cache key of a query from its normalized SQL, its bound parameters and the task's BigQuery settings,
+    which include the ProjectID and Location.
+    """
+    key = {
+        "sql": normalize_sql(statement),
+        "parameters": sorted((p.to_api_repr() for p in query_parameters), key=lambda p: p["name"]),
+        "custom": custom,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class BigQueryResultCache(object):
+    """
+    An in-memory, thread-safe map from a query's cache key to the destination table of the job that last ran it.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            uri, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return uri
+
+    def put(self, key: str, uri: str, ttl_seconds: float):
+        ttl_seconds = min(ttl_seconds, MAX_RESULT_CACHE_TTL_SECONDS)
+        with self._lock:
+            self._entries[key] = (uri, time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
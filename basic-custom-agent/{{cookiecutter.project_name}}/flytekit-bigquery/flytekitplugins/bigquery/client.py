@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from google.cloud import bigquery
+
+from flytekit import logger
+from flytekitplugins.agentmetrics import record_client_cache_lookup
+
+
+class BigQueryClientCache(object):
+    """
+    A thread-safe cache of BigQuery clients keyed by (project, location). The agent shares it between create, get and
+    delete, so credential discovery and HTTP session setup happen once per project instead of once per call.
+    """
+
+    def __init__(self, max_size: int = 32, idle_timeout_seconds: float = 600):
+        """
+        :param max_size: Maximum number of clients to keep, the least recently used client is dropped beyond that
+        :param idle_timeout_seconds: Clients that have not been used for this long are closed and dropped
+        """
+        self._max_size = max_size
+        self._idle_timeout_seconds = idle_timeout_seconds
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, project: Optional[str], location: Optional[str]) -> bigquery.Client:
+        key = (project, location)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            if key in self._clients:
+                self.hits += 1
+                record_client_cache_lookup("bigquery", hit=True)
+                client, _ = self._clients[key]
+                self._clients[key] = (client, now)
+                self._clients.move_to_end(key)
+                return client
+
+            self.misses += 1
+            record_client_cache_lookup("bigquery", hit=False)
+            client = bigquery.Client(project=project, location=location)
+            self._clients[key] = (client, now)
+            while len(self._clients) > self._max_size:
+                # the evicted client may still be in use by another thread, so it is left to the garbage collector
+                self._clients.popitem(last=False)
+            return client
+
+    def _evict_idle(self, now: float):
+        while self._clients:
+            key, (client, last_used) = next(iter(self._clients.items()))
+            if now - last_used < self._idle_timeout_seconds:
+                return
+            logger.debug(f"Closing BigQuery client for {key} after being idle for {now - last_used:.0f}s")
+            del self._clients[key]
+            client.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._clients)}
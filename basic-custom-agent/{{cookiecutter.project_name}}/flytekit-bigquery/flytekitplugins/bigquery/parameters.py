@@ -0,0 +1,88 @@
+import dataclasses
+import datetime
+import typing
+from typing import Any, Dict, List, Union
+
+from google.cloud import bigquery
+
+from flytekit import lazy_module
+from flytekit.types.structured import StructuredDataset
+
+pa = lazy_module("pyarrow")
+
+QueryParameter = Union[bigquery.ScalarQueryParameter, bigquery.ArrayQueryParameter, bigquery.StructQueryParameter]
+
+pythonTypeToBigQueryType: Dict[type, str] = {
+    # https://cloud.google.com/bigquery/docs/reference/standard-sql/data-types#data_type_sizes
+    list: "ARRAY",
+    bool: "BOOL",
+    bytes: "BYTES",
+    datetime.datetime: "DATETIME",
+    float: "FLOAT64",
+    int: "INT64",
+    str: "STRING",
+}
+
+
+def _arrow_type_to_bigquery_type(arrow_type) -> str:
+    if pa.types.is_boolean(arrow_type):
+        return "BOOL"
+    if pa.types.is_integer(arrow_type):
+        return "INT64"
+    if pa.types.is_floating(arrow_type):
+        return "FLOAT64"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "STRING"
+    if pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        return "BYTES"
+    if pa.types.is_timestamp(arrow_type):
+        return "TIMESTAMP" if arrow_type.tz else "DATETIME"
+    if pa.types.is_date(arrow_type):
+        return "DATE"
+    raise ValueError(f"Cannot bind a column of type {arrow_type} as a BigQuery query parameter")
+
+
+def _struct_fields(value: Any) -> Dict[str, Any]:
+    return dataclasses.asdict(value) if dataclasses.is_dataclass(value) else value
+
+
+def to_query_parameter(name: typing.Optional[str], python_type: type, value: Any) -> QueryParameter:
+    """
+    Binds a task input as a BigQuery query parameter, driven by the Python type Flyte derived from its literal type:
+
+    - scalars become a ScalarQueryParameter
+    - lists become an ArrayQueryParameter of their element type, so large IN-filters can be written as
+      ``WHERE id IN UNNEST(@ids)`` instead of inlining literals
+    - dataclasses and dicts become a StructQueryParameter, and lists of them an ARRAY of STRUCT
+    - a single-column StructuredDataset becomes an ArrayQueryParameter of that column. It is read as an Arrow
+      table, the client still serializes the parameter one value at a time
+    """
+    if python_type in pythonTypeToBigQueryType and python_type is not list:
+        return bigquery.ScalarQueryParameter(name, pythonTypeToBigQueryType[python_type], value)
+
+    if isinstance(value, StructuredDataset):
+        table = value.open(pa.Table).all()
+        if table.num_columns != 1:
+            raise ValueError(
+                f"Input {name} has {table.num_columns} columns, only a single column can be bound as an array"
+            )
+        column = table.column(0)
+        return bigquery.ArrayQueryParameter(name, _arrow_type_to_bigquery_type(column.type), column.to_pylist())
+
+    if isinstance(value, list):
+        args = typing.get_args(python_type)
+        element_type = args[0] if args else (type(value[0]) if value else str)
+        if element_type in pythonTypeToBigQueryType:
+            return bigquery.ArrayQueryParameter(name, pythonTypeToBigQueryType[element_type], value)
+        structs = [to_query_parameter(None, element_type, element) for element in value]
+        return bigquery.ArrayQueryParameter(name, "STRUCT", structs)
+
+    if dataclasses.is_dataclass(value) or isinstance(value, dict):
+        hints = typing.get_type_hints(type(value)) if dataclasses.is_dataclass(value) else {}
+        fields: List[QueryParameter] = [
+            to_query_parameter(field_name, hints.get(field_name, type(field_value)), field_value)
+            for field_name, field_value in _struct_fields(value).items()
+        ]
+        return bigquery.StructQueryParameter(name, *fields)
+
+    raise ValueError(f"Cannot bind input {name} of type {python_type} as a BigQuery query parameter")
@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import functools
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from google.cloud import bigquery
+
+from flytekit import logger
+
+from .client import BigQueryClientCache
+
+
+async def run_in_default_executor(operation: str, func: Callable, *args, **kwargs) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class BigQueryJobPoller(object):
+    """
+    Coalesces the job lookups of concurrent ``BigQueryAgent.get`` calls. Lookups for the same (project, location) that
+    arrive within ``window_seconds`` are resolved together with a single jobs.list request, so the number of API calls
+    per poll interval stays flat as the number of in-flight jobs grows. A lone lookup, or a job that is missing from
+    the listing, falls back to a plain jobs.get. A lookup that fails only fails the callers of that job.
+
+    Waiting for a batch happens on the event loop, only the requests to BigQuery are run through ``run_blocking``.
+    """
+
+    def __init__(
+        self,
+        client_cache: BigQueryClientCache,
+        window_seconds: float = 0.2,
+        max_list_results: int = 1000,
+        lookback_margin_seconds: float = 300,
+        run_blocking: Optional[Callable[..., Awaitable[Any]]] = None,
+    ):
+        """
+        :param client_cache: Cache to take the client for each (project, location) from
+        :param window_seconds: How long the first lookup of a batch waits for others to join it
+        :param max_list_results: Maximum number of jobs to page through in a single jobs.list request
+        :param lookback_margin_seconds: How far before a job was first polled its creation time may lie
+        :param run_blocking: Awaits a blocking call as ``run_blocking(operation, func, *args)``, by default in the
+            event loop's default executor
+        """
+        self._client_cache = client_cache
+        self._window_seconds = window_seconds
+        self._max_list_results = max_list_results
+        self._lookback_margin = datetime.timedelta(seconds=lookback_margin_seconds)
+        self._run_blocking = run_blocking or run_in_default_executor
+        self._pending: Dict[Tuple[str, str], Dict[str, List[asyncio.Future]]] = {}
+        # the first time each job was polled, used to bound jobs.list by creation time, and the last time, to forget
+        # jobs that are no longer polled
+        self._first_seen: Dict[str, datetime.datetime] = {}
+        self._last_polled: Dict[str, datetime.datetime] = {}
+        # keeps the flush tasks referenced until they finish
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def get_job(self, job_id: str, project: str, location: str) -> bigquery.QueryJob:
+        key = (project, location)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self._first_seen.setdefault(job_id, now)
+        self._last_polled[job_id] = now
+        batch = self._pending.setdefault(key, {})
+        if not batch:
+            # the batch is resolved by a task of its own, so it does not depend on the first caller staying around
+            flush = asyncio.ensure_future(self._flush(key))
+            self._flushes.add(flush)
+            flush.add_done_callback(self._flushes.discard)
+        future = asyncio.get_running_loop().create_future()
+        batch.setdefault(job_id, []).append(future)
+        return await future
+
+    async def _flush(self, key: Tuple[str, str]):
+        await asyncio.sleep(self._window_seconds)
+        batch = self._pending.pop(key)
+        try:
+            results = await self._resolve(key, batch)
+        except Exception as e:
+            results = {job_id: e for job_id in batch}
+
+        for job_id, futures in batch.items():
+            result = results[job_id]
+            failed = isinstance(result, BaseException)
+            if failed or result.state == "DONE":
+                # the job will not be polled again, or starts over with a fresh lower bound when it is
+                self._forget(job_id)
+            for future in futures:
+                # a caller that was cancelled has cancelled its future
+                if future.done():
+                    continue
+                if failed:
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        self._forget_unpolled()
+
+    def _forget(self, job_id: str):
+        self._first_seen.pop(job_id, None)
+        self._last_polled.pop(job_id, None)
+
+    def _forget_unpolled(self):
+        # e.g. jobs whose task was aborted, they were neither done nor failed when they were polled last
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - self._lookback_margin
+        for job_id in [job_id for job_id, polled_at in self._last_polled.items() if polled_at < cutoff]:
+            self._forget(job_id)
+
+    def _list_jobs(self, project: str, location: str, min_creation_time: datetime.datetime) -> List[bigquery.QueryJob]:
+        client = self._client_cache.get(project, location)
+        # the listing is paged lazily, so it is read completely here rather than on the event loop
+        return list(
+            client.list_jobs(project=project, min_creation_time=min_creation_time, max_results=self._max_list_results)
+        )
+
+    def _get_job(self, job_id: str, project: str, location: str) -> bigquery.QueryJob:
+        client = self._client_cache.get(project, location)
+        return client.get_job(job_id, project, location)
+
+    async def _resolve(
+        self, key: Tuple[str, str], batch: Dict[str, List[asyncio.Future]]
+    ) -> Dict[str, Union[bigquery.QueryJob, BaseException]]:
+        """
+        Returns the job, or the error of looking it up, for every job id in the batch.
+        """
+        project, location = key
+        jobs = {}
+        if len(batch) > 1:
+            min_creation_time = min(self._first_seen[job_id] for job_id in batch) - self._lookback_margin
+            try:
+                listed = await self._run_blocking("list_jobs", self._list_jobs, project, location, min_creation_time)
+            except Exception as e:
+                logger.warning(f"Failed to list BigQuery jobs in {project}, getting them one by one: {e}")
+                listed = []
+            for job in listed:
+                # without a configured location the job runs wherever BigQuery puts it, its id is enough
+                if job.job_id in batch and (location is None or job.location == location):
+                    jobs[job.job_id] = job
+            logger.debug(f"Resolved {len(jobs)} of {len(batch)} BigQuery jobs in {project} with one list request")
+
+        missing = [job_id for job_id in batch if job_id not in jobs]
+        # e.g. a NotFound for an expired job only fails that job
+        fetched = await asyncio.gather(
+            *(self._run_blocking("get_job", self._get_job, job_id, project, location) for job_id in missing),
+            return_exceptions=True,
+        )
+        jobs.update(zip(missing, fetched))
+        return jobs
@@ -0,0 +1,128 @@
+import queue
+import re
+import threading
+import typing
+
+import pyarrow as pa
+from google.cloud import bigquery_storage
+from google.cloud.bigquery_storage_v1 import types
+
+from flytekit import FlyteContext
+from flytekit.models import literals
+from flytekit.types.structured.structured_dataset import (
+    StructuredDatasetDecoder,
+    StructuredDatasetMetadata,
+    StructuredDatasetTransformerEngine,
+)
+
+BIGQUERY = "bq"
+
+# Marks the end of one read stream in the queue shared by the stream readers
+_STREAM_DONE = object()
+
+
+def read_record_batches(
+    read_client: bigquery_storage.BigQueryReadClient,
+    uri: str,
+    columns: typing.Optional[typing.List[str]] = None,
+    max_streams: int = 4,
+    max_queued_batches: int = 8,
+) -> typing.Generator[pa.RecordBatch, None, None]:
+    """
+    Streams a BigQuery table as Arrow record batches through the BigQuery Storage Read API. Up to ``max_streams`` read
+    streams are consumed in parallel, and at most ``max_queued_batches`` batches are buffered, so memory stays bounded
+    by the batch size however large the table is. Batches from different streams are yielded in arrival order.
+
+    :param read_client: BigQuery Storage read client, or anything with the same create_read_session and read_rows
+    :param uri: Table to read, in the form bq://project:dataset.table
+    :param columns: Columns to read, all columns if not set
+    :param max_streams: Maximum number of read streams to request and consume concurrently
+    :param max_queued_batches: Maximum number of batches read ahead of the consumer
+    """
+    _, project_id, dataset_id, table_id = re.split("\\.|://|:", uri)
+    read_options = types.ReadSession.TableReadOptions(selected_fields=columns) if columns else None
+    requested_session = types.ReadSession(
+        table=f"projects/{project_id}/datasets/{dataset_id}/tables/{table_id}",
+        data_format=types.DataFormat.ARROW,
+        read_options=read_options,
+    )
+    read_session = read_client.create_read_session(
+        parent=f"projects/{project_id}", read_session=requested_session, max_stream_count=max_streams
+    )
+    if not read_session.streams:
+        return
+
+    batches = queue.Queue(maxsize=max_queued_batches)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read_stream(stream_name: str):
+        try:
+            for page in read_client.read_rows(stream_name).rows(read_session).pages:
+                if not put(page.to_arrow()):
+                    return
+        except Exception as e:
+            put(e)
+        put(_STREAM_DONE)
+
+    readers = [
+        threading.Thread(target=read_stream, args=(stream.name,), daemon=True) for stream in read_session.streams
+    ]
+    for reader in readers:
+        reader.start()
+
+    remaining = len(readers)
+    try:
+        while remaining:
+            item = batches.get()
+            if item is _STREAM_DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        # also reached when the consumer stops iterating early, which lets the readers exit
+        stopped.set()
+
+
+class BigQueryToArrowStreamDecodingHandler(StructuredDatasetDecoder):
+    """
+    Decodes a bq:// StructuredDataset, such as the results of a BigQueryTask, into a stream of Arrow record batches:
+
+        for batch in results.open(pa.RecordBatch).iter():
+            ...
+    """
+
+    def __init__(self, max_streams: int = 4, max_queued_batches: int = 8):
+        super().__init__(pa.RecordBatch, BIGQUERY, supported_format="")
+        self._max_streams = max_streams
+        self._max_queued_batches = max_queued_batches
+
+    def decode(
+        self,
+        ctx: FlyteContext,
+        flyte_value: literals.StructuredDataset,
+        current_task_metadata: StructuredDatasetMetadata,
+    ) -> typing.Generator[pa.RecordBatch, None, None]:
+        columns = None
+        if current_task_metadata.structured_dataset_type and current_task_metadata.structured_dataset_type.columns:
+            columns = [c.name for c in current_task_metadata.structured_dataset_type.columns]
+        yield from read_record_batches(
+            bigquery_storage.BigQueryReadClient(),
+            flyte_value.uri,
+            columns,
+            max_streams=self._max_streams,
+            max_queued_batches=self._max_queued_batches,
+        )
+
+
+StructuredDatasetTransformerEngine.register(BigQueryToArrowStreamDecodingHandler())
@@ -18,11 +18,20 @@ bigquery = lazy_module("google.cloud.bigquery")
 class BigQueryConfig(object):
     """
     BigQueryConfig should be used to configure a BigQuery Task.
+
+    Set ResultCacheTTLSeconds to let the agent reuse the result of an identical read-only query (same SQL, inputs and
+    settings) that succeeded within that many seconds, instead of running a new job. Results are kept for at most
+    23 hours, since BigQuery deletes anonymous result tables after a day.
+
+    Set DryRun to have the agent estimate the bytes a query will process before running it. The estimate is shown on
+    the console log link, and queries estimated above QueryJobConfig.maximum_bytes_billed fail without running.
     """
 
     ProjectID: str
     Location: Optional[str] = None
     QueryJobConfig: Optional[bigquery.QueryJobConfig] = None
+    ResultCacheTTLSeconds: Optional[int] = None
+    DryRun: bool = False
 
 
 class BigQueryTask(AsyncAgentExecutorMixin, SQLTask[BigQueryConfig]):
@@ -74,6 +83,10 @@ class BigQueryTask(AsyncAgentExecutorMixin, SQLTask[BigQueryConfig]):
             "Location": self.task_config.Location,
             "ProjectID": self.task_config.ProjectID,
         }
+        if self.task_config.ResultCacheTTLSeconds is not None:
+            config["ResultCacheTTLSeconds"] = self.task_config.ResultCacheTTLSeconds
+        if self.task_config.DryRun:
+            config["DryRun"] = True
         if self.task_config.QueryJobConfig is not None:
             config.update(self.task_config.QueryJobConfig.to_api_repr()["query"])
         s = Struct()
@@ -9,6 +9,9 @@ plugin_requires = [
     "google-cloud-bigquery>=3.21.0",
     "google-cloud-bigquery-storage>=2.25.0",
     "flyteidl>1.10.7",
+    "flytekitplugins-agentmetrics",
+    "prometheus-client",
+    "pyarrow",
 ]
 
 __version__ = "0.0.0+develop"
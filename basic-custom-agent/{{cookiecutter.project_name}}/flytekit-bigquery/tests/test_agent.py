@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from flytekitplugins.bigquery.agent import BigQueryAgent, BigQueryMetadata
+
+
+class UnusedClientCache(object):
+    def get(self, project, location):
+        raise AssertionError(f"Requested a BigQuery client for {project} in {location}")
+
+
+@pytest.mark.parametrize(
+    "resource_meta",
+    [
+        BigQueryMetadata(
+            job_id="",
+            project="flyte",
+            location="us-west1",
+            estimated_bytes_processed=10**12,
+            error_message="Rejected BigQuery query: it is estimated to process 1.0 TB",
+        ),
+        BigQueryMetadata(job_id="", project="flyte", location="us-west1", cached_output_location="bq://flyte:d.t"),
+    ],
+    ids=["rejected by dry run", "cached result"],
+)
+def test_delete_without_a_job(resource_meta):
+    agent = BigQueryAgent(client_cache=UnusedClientCache())
+    asyncio.run(agent.delete(resource_meta))
@@ -1,27 +1,47 @@
 import asyncio
 import logging
+import time
 from typing import Optional
 
 from flyteidl.core.execution_pb2 import TaskExecution
 
-from flytekit import FlyteContextManager, lazy_module
+from flytekit import FlyteContextManager
 from flytekit.core.type_engine import TypeEngine
 from flytekit.extend.backend.base_agent import AgentRegistry, Resource, SyncAgentBase
-from flytekit.extend.backend.utils import get_agent_secret
 from flytekit.models.literals import LiteralMap
 from flytekit.models.task import TaskTemplate
+from flytekitplugins.agentmetrics import InstrumentedAgentMixin, external_call
 
-openai = lazy_module("openai")
+from .batcher import ChatGPTBatcher
+from .cache import ChatGPTResponseCache, default_response_cache, is_cacheable_config
+from .client import ChatGPTClientCache
+from .request import ChatGPTRequestPrototype, ChatGPTRequestPrototypeCache
+from .scheduler import ChatGPTScheduler
+from .streaming import chatgpt_latency, stream_completion
 
 TIMEOUT_SECONDS = 10
 OPENAI_API_KEY = "FLYTE_OPENAI_API_KEY"
 
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
-class ChatGPTAgent(SyncAgentBase):
+
+class ChatGPTAgent(InstrumentedAgentMixin, SyncAgentBase):
     name = "ChatGPT Agent"
 
-    def __init__(self):
+    def __init__(
+        self,
+        client_cache: Optional[ChatGPTClientCache] = None,
+        scheduler: Optional[ChatGPTScheduler] = None,
+        batcher: Optional[ChatGPTBatcher] = None,
+        response_cache: Optional[ChatGPTResponseCache] = None,
+        prototypes: Optional[ChatGPTRequestPrototypeCache] = None,
+    ):
         super().__init__(task_type_name="chatgpt")
+        self.client_cache = client_cache or ChatGPTClientCache(secret_key=OPENAI_API_KEY)
+        self.scheduler = scheduler or ChatGPTScheduler()
+        self.batcher = batcher or ChatGPTBatcher()
+        self.response_cache = response_cache or default_response_cache()
+        self.prototypes = prototypes or ChatGPTRequestPrototypeCache()
 
     async def do(
         self,
@@ -33,21 +53,50 @@ class ChatGPTAgent(SyncAgentBase):
         input_python_value = TypeEngine.literal_map_to_kwargs(ctx, inputs, {"message": str})
         message = input_python_value["message"]
 
-        custom = task_template.custom
-        custom["chatgpt_config"]["messages"] = [{"role": "user", "content": message}]
-        client = openai.AsyncOpenAI(
-            organization=custom["openai_organization"],
-            api_key=get_agent_secret(secret_key=OPENAI_API_KEY),
-        )
-
-        logger = logging.getLogger("httpx")
-        logger.setLevel(logging.WARNING)
+        prototype = self.prototypes.get(task_template)
+        cache_key = None
+        # a request whose completion may be reused, also by identical requests that are in flight at the same time
+        reusable = is_cacheable_config(prototype.chatgpt_config, prototype.cache_nondeterministic)
+        if self.response_cache is not None and reusable:
+            cache_key = prototype.cache_key(message)
+            cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is not None:
+                return Resource(phase=TaskExecution.SUCCEEDED, outputs={"o0": cached})
 
-        completion = await asyncio.wait_for(client.chat.completions.create(**custom["chatgpt_config"]), TIMEOUT_SECONDS)
-        message = completion.choices[0].message.content
+        if prototype.batch_window_seconds is None or not reusable:
+            # batching requests that cannot share a completion would only delay them
+            message = await self._complete(prototype, message)
+        else:
+            message = await self.batcher.submit(
+                prototype.fingerprint, message, prototype.batch_window_seconds, lambda m: self._complete(prototype, m)
+            )
+        if cache_key is not None:
+            await asyncio.to_thread(self.response_cache.put, cache_key, message)
         outputs = {"o0": message}
 
         return Resource(phase=TaskExecution.SUCCEEDED, outputs=outputs)
 
+    async def _complete(self, prototype: ChatGPTRequestPrototype, message: str) -> str:
+        client = self.client_cache.get(prototype.organization)
+        messages = prototype.messages(message)
+        estimated_tokens = prototype.estimated_tokens(message)
+        task_type = self.task_category.name
+
+        async def request():
+            with external_call(task_type, "chat.completions.create"):
+                if prototype.stream:
+                    return await stream_completion(client, prototype.chatgpt_config, messages)
+                started_at = time.monotonic()
+                completion = await asyncio.wait_for(
+                    client.chat.completions.create(**prototype.chatgpt_config, messages=messages), TIMEOUT_SECONDS
+                )
+                chatgpt_latency.labels(model=prototype.model, stream="false").observe(time.monotonic() - started_at)
+                return completion
+
+        completion = await self.scheduler.submit(prototype.organization, prototype.model, estimated_tokens, request)
+        if prototype.stream:
+            return completion.content
+        return completion.choices[0].message.content
+
 
 AgentRegistry.register(ChatGPTAgent())
@@ -0,0 +1,80 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Set
+
+MAX_BATCH_SIZE = int(os.getenv("FLYTE_OPENAI_MAX_BATCH_SIZE", "64"))
+
+
+class ChatGPTBatcher(object):
+    """
+    Deduplicates concurrent ChatGPT requests that share an organization and chatgpt_config.
+
+    The first request for a key opens a batch and waits ``window_seconds`` for others to join it, a batch that
+    reaches ``max_batch_size`` distinct messages is sent right away. Identical messages in a batch are sent once and
+    the completion is handed to every caller, so only requests whose completion may be reused belong here, see
+    is_cacheable_config. The distinct messages of a batch are still separate chat completions, the API has no
+    synchronous batch endpoint.
+    """
+
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE):
+        self._max_batch_size = max_batch_size
+        # key -> message -> the future of its completion
+        self._batches: Dict[str, Dict[str, asyncio.Future]] = {}
+        # keeps the send tasks referenced until they finish
+        self._sends: Set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        key: str,
+        message: str,
+        window_seconds: float,
+        send: Callable[[str], Awaitable[str]],
+    ) -> str:
+        """
+        :param key: The batch key, see ChatGPTRequestPrototype.fingerprint
+        :param message: The user message of this request
+        :param window_seconds: How long the first request of a batch waits for others to join
+        :param send: Sends a single message and returns its completion
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        leader = batch is None or next(iter(batch.values())).get_loop() is not loop
+        if leader:
+            batch = self._batches[key] = {}
+
+        future = batch.get(message)
+        if future is None:
+            future = batch[message] = loop.create_future()
+            if len(batch) >= self._max_batch_size:
+                self._dispatch(key, batch, send)
+
+        if leader:
+            try:
+                await asyncio.sleep(window_seconds)
+            finally:
+                # the batch goes out even when the leader itself is cancelled while waiting
+                self._dispatch(key, batch, send)
+
+        # a cancelled caller must not cancel the request the other callers of the same message are waiting on
+        return await asyncio.shield(future)
+
+    def _dispatch(self, key: str, batch: Dict[str, asyncio.Future], send: Callable[[str], Awaitable[str]]):
+        if self._batches.get(key) is not batch:
+            # already sent because it filled up
+            return
+        del self._batches[key]
+        for message, future in batch.items():
+            task = asyncio.ensure_future(self._send(message, future, send))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    @staticmethod
+    async def _send(message: str, future: asyncio.Future, send: Callable[[str], Awaitable[str]]):
+        try:
+            result = await send(message)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
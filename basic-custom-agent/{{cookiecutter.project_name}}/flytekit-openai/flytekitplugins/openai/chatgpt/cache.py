@@ -0,0 +1,128 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Mapping, Optional
+
+# "memory", "sqlite" or "none"
+RESPONSE_CACHE = os.getenv("FLYTE_OPENAI_RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_PATH = os.getenv("FLYTE_OPENAI_RESPONSE_CACHE_PATH", "/tmp/flyte_openai_response_cache.sqlite")
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("FLYTE_OPENAI_RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("FLYTE_OPENAI_RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+
+def is_cacheable_config(chatgpt_config: Mapping[str, Any], cache_nondeterministic: bool = False) -> bool:
+    """
+    Only a request sampled at temperature 0 is expected to get the same completion every time. OpenAI samples at
+    temperature 1 when the config does not set one, or sets it to None.
+    """
+    temperature = chatgpt_config.get("temperature")
+    return cache_nondeterministic or (temperature is not None and float(temperature) == 0)
+
+
+class ChatGPTResponseCache(ABC):
+    """
+    A map from a request's cache key, see ChatGPTRequestPrototype.cache_key, to the completion it got.
+    Implementations must be thread-safe.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def put(self, key: str, response: str, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        ...
+
+
+class InMemoryResponseCache(ChatGPTResponseCache):
+    """
+    Keeps up to ``max_entries`` completions in the agent's memory, evicting the least recently used one first.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return response
+
+    def put(self, key: str, response: str, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteResponseCache(ChatGPTResponseCache):
+    """
+    Keeps up to ``max_entries`` completions in a SQLite database on disk, so they survive agent restarts.
+    Expired and least recently used entries are evicted every ``evict_every`` writes.
+    """
+
+    def __init__(
+        self, path: str = RESPONSE_CACHE_PATH, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, evict_every: int = 100
+    ):
+        self._max_entries = max_entries
+        self._evict_every = evict_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, response: str, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, now + ttl_seconds, now),
+            )
+            self._writes += 1
+            if self._writes % self._evict_every == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self._max_entries,),
+        )
+
+
+def default_response_cache() -> Optional[ChatGPTResponseCache]:
+    if RESPONSE_CACHE == "sqlite":
+        return SQLiteResponseCache()
+    if RESPONSE_CACHE == "memory":
+        return InMemoryResponseCache()
+    return None
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from flytekit import lazy_module
+from flytekit.extend.backend.utils import get_agent_secret
+
+openai = lazy_module("openai")
+httpx = lazy_module("httpx")
+
+MAX_CONNECTIONS = int(os.getenv("FLYTE_OPENAI_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("FLYTE_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("FLYTE_OPENAI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# HTTP/2 multiplexes requests over a single connection, it needs the h2 package (pip install httpx[http2])
+HTTP2 = os.getenv("FLYTE_OPENAI_HTTP2", "false").lower() == "true"
+# How long a replaced client stays open for the requests still running on it, the read timeout of its requests
+STALE_CLIENT_CLOSE_DELAY_SECONDS = 600
+
+
+class ChatGPTClientCache(object):
+    """
+    Keeps one long-lived AsyncOpenAI client, and with it one pool of open connections, per organization and API key.
+    The API key secret is re-read at most every ``secret_refresh_seconds``, and a rotated key gets a new client.
+    Clients are bound to the event loop they were created on, so a client is also rebuilt when the loop changes.
+    A replaced client is closed on its own loop once the requests still running on it have had time to finish.
+    """
+
+    def __init__(
+        self,
+        secret_key: str,
+        secret_refresh_seconds: float = 60,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry_seconds: float = KEEPALIVE_EXPIRY_SECONDS,
+        http2: bool = HTTP2,
+    ):
+        self._secret_key = secret_key
+        self._secret_refresh_seconds = secret_refresh_seconds
+        self._max_connections = max_connections
+        self._max_keepalive_connections = max_keepalive_connections
+        self._keepalive_expiry_seconds = keepalive_expiry_seconds
+        self._http2 = http2
+        self._api_key: Optional[str] = None
+        self._api_key_read_at = 0.0
+        # (organization, api key) -> (client, event loop the client was created on)
+        self._clients: Dict[Tuple[Optional[str], str], tuple] = {}
+
+    def _get_api_key(self) -> str:
+        now = time.monotonic()
+        if self._api_key is None or now - self._api_key_read_at >= self._secret_refresh_seconds:
+            self._api_key = get_agent_secret(secret_key=self._secret_key)
+            self._api_key_read_at = now
+        return self._api_key
+
+    def get(self, organization: Optional[str]) -> "openai.AsyncOpenAI":
+        api_key = self._get_api_key()
+        loop = asyncio.get_running_loop()
+        key = (organization, api_key)
+        entry = self._clients.get(key)
+        if entry is not None and entry[1] is loop:
+            return entry[0]
+
+        # replace the clients of rotated keys, requests that are still running on them finish normally
+        for stale_key in [k for k in self._clients if k[0] == organization]:
+            self._close_later(*self._clients.pop(stale_key))
+
+        client = openai.AsyncOpenAI(
+            organization=organization,
+            api_key=api_key,
+            # retries are done by the ChatGPTScheduler, which knows about the rate limit budgets
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_keepalive_connections,
+                    keepalive_expiry=self._keepalive_expiry_seconds,
+                ),
+                timeout=httpx.Timeout(600, connect=5),
+                http2=self._http2,
+            ),
+        )
+        self._clients[key] = (client, loop)
+        return client
+
+    @staticmethod
+    def _close_later(client: "openai.AsyncOpenAI", loop: asyncio.AbstractEventLoop):
+        if loop.is_closed():
+            # the connections of a client are closed together with its loop
+            return
+
+        def close():
+            asyncio.ensure_future(client.close(), loop=loop)
+
+        # the loop may be running in another thread, e.g. after a local execution started a new one
+        loop.call_soon_threadsafe(loop.call_later, STALE_CLIENT_CLOSE_DELAY_SECONDS, close)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+from flytekit.models.task import TaskTemplate
+
+# Completion tokens budgeted for a request that does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+_PER_REQUEST_KEYS = ("messages", "stream", "stream_options")
+
+
+@dataclass(frozen=True)
+class ChatGPTRequestPrototype(object):
+    """
+    Everything the agent needs from a ChatGPT task template, parsed and validated once. ``fingerprint`` identifies
+    the organization and chatgpt_config, it keys both request batches and cached responses.
+    """
+
+    organization: Optional[str]
+    model: str
+    chatgpt_config: Mapping[str, Any]
+    fingerprint: str
+    completion_tokens: int
+    batch_window_seconds: Optional[float] = None
+    cache_nondeterministic: bool = False
+    stream: bool = False
+
+    @classmethod
+    def from_custom(cls, custom: Dict[str, Any]) -> "ChatGPTRequestPrototype":
+        chatgpt_config = custom.get("chatgpt_config")
+        if not isinstance(chatgpt_config, dict) or "model" not in chatgpt_config:
+            raise ValueError("The 'model' configuration variable is required in chatgpt_config")
+        # messages are added per request, the task's own message is the only user input, and streaming is chosen
+        # by the agent because it changes the shape of the response
+        stream = bool(custom.get("stream", False) or chatgpt_config.get("stream", False))
+        chatgpt_config = {k: v for k, v in chatgpt_config.items() if k not in _PER_REQUEST_KEYS}
+        organization = custom.get("openai_organization")
+        fingerprint = json.dumps(
+            {"organization": organization, "chatgpt_config": chatgpt_config}, sort_keys=True, default=str
+        )
+        return cls(
+            organization=organization,
+            model=chatgpt_config["model"],
+            chatgpt_config=MappingProxyType(chatgpt_config),
+            fingerprint=fingerprint,
+            completion_tokens=int(chatgpt_config.get("max_tokens") or DEFAULT_COMPLETION_TOKENS),
+            batch_window_seconds=custom.get("batch_window_seconds"),
+            cache_nondeterministic=bool(custom.get("cache_nondeterministic", False)),
+            stream=stream,
+        )
+
+    def messages(self, message: str):
+        return [{"role": "user", "content": message}]
+
+    def estimated_tokens(self, message: str) -> int:
+        # roughly four characters per token, plus the completion the request may produce
+        return len(message) // 4 + self.completion_tokens
+
+    def cache_key(self, message: str) -> str:
+        return hashlib.sha256(f"{self.fingerprint}\0{message}".encode()).hexdigest()
+
+
+class ChatGPTRequestPrototypeCache(object):
+    """
+    Keeps the request prototypes of up to ``max_size`` task templates. A registered template is identified by its
+    project, domain, name and version, which Flyte never reuses for a different template. Templates without a
+    version, as in local executions, are parsed on every request.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self._max_size = max_size
+        self._prototypes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, task_template: TaskTemplate) -> ChatGPTRequestPrototype:
+        template_id = task_template.id
+        if template_id is None or not template_id.version:
+            return ChatGPTRequestPrototype.from_custom(task_template.custom)
+
+        key = (template_id.project, template_id.domain, template_id.name, template_id.version)
+        with self._lock:
+            prototype = self._prototypes.get(key)
+            if prototype is not None:
+                self._prototypes.move_to_end(key)
+                return prototype
+
+        prototype = ChatGPTRequestPrototype.from_custom(task_template.custom)
+        with self._lock:
+            self._prototypes[key] = prototype
+            while len(self._prototypes) > self._max_size:
+                self._prototypes.popitem(last=False)
+        return prototype
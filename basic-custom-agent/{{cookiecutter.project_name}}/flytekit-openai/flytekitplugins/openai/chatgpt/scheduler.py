@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from flytekit import lazy_module, logger
+
+openai = lazy_module("openai")
+
+REQUESTS_PER_MINUTE = int(os.getenv("FLYTE_OPENAI_REQUESTS_PER_MINUTE", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("FLYTE_OPENAI_TOKENS_PER_MINUTE", "200000"))
+# Per model budgets, e.g. {"gpt-4": {"requests_per_minute": 100, "tokens_per_minute": 40000}}
+MODEL_LIMITS = json.loads(os.getenv("FLYTE_OPENAI_MODEL_LIMITS", "{}"))
+MAX_CONCURRENCY = int(os.getenv("FLYTE_OPENAI_MAX_CONCURRENCY", "64"))
+MAX_RETRIES = int(os.getenv("FLYTE_OPENAI_MAX_RETRIES", "5"))
+
+
+class TokenBucket(object):
+    """
+    A bucket that refills continuously up to ``per_minute`` units over a minute.
+    """
+
+    def __init__(self, per_minute: float):
+        self._capacity = per_minute
+        self._rate = per_minute / 60
+        self._available = per_minute
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(self._capacity, self._available + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    async def acquire(self, amount: float):
+        # a request larger than the whole budget waits for a full bucket instead of forever
+        amount = min(amount, self._capacity)
+        while True:
+            self._refill()
+            if self._available >= amount:
+                self._available -= amount
+                return
+            await asyncio.sleep((amount - self._available) / self._rate)
+
+    def adjust(self, amount: float):
+        """
+        Returns over-estimated units to the bucket, or takes under-estimated ones (possibly going negative).
+        """
+        self._refill()
+        self._available = min(self._capacity, self._available + amount)
+
+
+def _is_retryable(e: Exception) -> bool:
+    # a request that timed out may have been processed and billed, and is likely to time out again, so only rate
+    # limits, server errors and failed connections are retried
+    if isinstance(e, openai.APITimeoutError):
+        return False
+    if isinstance(e, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _retry_after_seconds(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ChatGPTScheduler(object):
+    """
+    Schedules ChatGPT requests against requests-per-minute and tokens-per-minute budgets kept per organization and
+    model. Requests for the same budget are admitted in arrival order, so a large request is not starved by smaller
+    ones behind it, and at most ``max_concurrency`` requests are in flight. Rate limit (429), server (5xx) and
+    connection errors are retried with jittered exponential backoff, honoring Retry-After. Timeouts are not retried.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = TOKENS_PER_MINUTE,
+        model_limits: Optional[Dict[str, Dict[str, int]]] = None,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        base_backoff_seconds: float = 1,
+        max_backoff_seconds: float = 60,
+    ):
+        self._requests_per_minute = requests_per_minute
+        self._tokens_per_minute = tokens_per_minute
+        self._model_limits = MODEL_LIMITS if model_limits is None else model_limits
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._base_backoff_seconds = base_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._buckets: Dict[Tuple[Optional[str], str], Tuple[TokenBucket, TokenBucket]] = {}
+        # asyncio locks wake their waiters in FIFO order, which gives each budget a fair queue
+        self._admission: Dict[Tuple[Optional[str], str], asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_buckets(self, key: Tuple[Optional[str], str]) -> Tuple[TokenBucket, TokenBucket]:
+        if key not in self._buckets:
+            limits = self._model_limits.get(key[1], {})
+            self._buckets[key] = (
+                TokenBucket(limits.get("requests_per_minute", self._requests_per_minute)),
+                TokenBucket(limits.get("tokens_per_minute", self._tokens_per_minute)),
+            )
+        return self._buckets[key]
+
+    async def submit(
+        self,
+        organization: Optional[str],
+        model: str,
+        estimated_tokens: int,
+        request: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        :param organization: OpenAI organization the request is billed to
+        :param model: Model the request is sent to
+        :param estimated_tokens: Prompt plus completion tokens the request is expected to use
+        :param request: Makes the request, called once per attempt
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio primitives belong to a single event loop, local executions may run each task on a new one
+            self._loop = loop
+            self._admission.clear()
+            self._in_flight = asyncio.Semaphore(self._max_concurrency)
+        key = (organization, model)
+        requests_bucket, tokens_bucket = self._get_buckets(key)
+
+        attempt = 0
+        while True:
+            async with self._admission[key]:
+                await requests_bucket.acquire(1)
+                await tokens_bucket.acquire(estimated_tokens)
+            try:
+                async with self._in_flight:
+                    result = await request()
+            except Exception as e:
+                if attempt >= self._max_retries or not _is_retryable(e):
+                    raise
+                backoff = _retry_after_seconds(e)
+                if backoff is None:
+                    backoff = random.uniform(0, min(self._max_backoff_seconds, self._base_backoff_seconds * 2**attempt))
+                attempt += 1
+                logger.warning(f"ChatGPT request failed with {e!r}, retry {attempt} in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+                continue
+
+            usage = getattr(result, "usage", None)
+            if usage is not None and usage.total_tokens is not None:
+                tokens_bucket.adjust(estimated_tokens - usage.total_tokens)
+            return result
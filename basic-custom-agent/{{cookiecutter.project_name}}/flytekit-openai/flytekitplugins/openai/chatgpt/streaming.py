@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional
+
+from prometheus_client import Histogram
+
+from flytekit import lazy_module
+
+openai = lazy_module("openai")
+
+# How long to wait for the response to start, which includes the time the model spends on the prompt
+FIRST_CHUNK_TIMEOUT_SECONDS = float(os.getenv("FLYTE_OPENAI_FIRST_CHUNK_TIMEOUT_SECONDS", "30"))
+# How long the stream may stay silent once it has started
+IDLE_TIMEOUT_SECONDS = float(os.getenv("FLYTE_OPENAI_IDLE_TIMEOUT_SECONDS", "10"))
+
+chatgpt_latency = Histogram(
+    "flyte_agent_chatgpt_latency_seconds",
+    "Time from sending a ChatGPT request to receiving the whole completion, per attempt",
+    ["model", "stream"],
+)
+chatgpt_time_to_first_token = Histogram(
+    "flyte_agent_chatgpt_time_to_first_token_seconds",
+    "Time from sending a streamed ChatGPT request to receiving the first completion token",
+    ["model"],
+)
+chatgpt_tokens_per_second = Histogram(
+    "flyte_agent_chatgpt_tokens_per_second",
+    "Completion tokens per second of a streamed ChatGPT request, measured from the first token",
+    ["model"],
+    buckets=[1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 300, 500],
+)
+
+
+@dataclass
+class StreamedCompletion(object):
+    """
+    The content and usage collected from a completion stream, usage is None if the API did not report it.
+    """
+
+    content: str
+    usage: Optional[Any] = None
+
+
+async def _next_chunk(stream, timeout: float):
+    try:
+        return await asyncio.wait_for(stream.__anext__(), timeout)
+    except StopAsyncIteration:
+        return None
+
+
+async def stream_completion(
+    client: "openai.AsyncOpenAI",
+    chatgpt_config: Mapping[str, Any],
+    messages: List[Dict[str, str]],
+    first_chunk_timeout_seconds: float = FIRST_CHUNK_TIMEOUT_SECONDS,
+    idle_timeout_seconds: float = IDLE_TIMEOUT_SECONDS,
+) -> StreamedCompletion:
+    """
+    Streams a chat completion. Instead of bounding the whole response, which fails long generations, each chunk
+    must arrive within ``idle_timeout_seconds`` of the previous one. Raises asyncio.TimeoutError otherwise.
+    """
+    model = chatgpt_config["model"]
+    started_at = time.monotonic()
+    stream = await asyncio.wait_for(
+        client.chat.completions.create(
+            **chatgpt_config, messages=messages, stream=True, stream_options={"include_usage": True}
+        ),
+        first_chunk_timeout_seconds,
+    )
+    parts = []
+    usage = None
+    content_chunks = 0
+    first_token_at = None
+    timeout = first_chunk_timeout_seconds
+    try:
+        while True:
+            chunk = await _next_chunk(stream, timeout)
+            if chunk is None:
+                break
+            timeout = idle_timeout_seconds
+            if chunk.usage is not None:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                if choice.index == 0 and choice.delta.content:
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                        chatgpt_time_to_first_token.labels(model=model).observe(first_token_at - started_at)
+                    parts.append(choice.delta.content)
+                    content_chunks += 1
+    finally:
+        await stream.close()
+
+    finished_at = time.monotonic()
+    chatgpt_latency.labels(model=model, stream="true").observe(finished_at - started_at)
+    if first_token_at is not None and finished_at > first_token_at:
+        # each content chunk carries about one token when the API does not report usage
+        completion_tokens = usage.completion_tokens if usage is not None else content_chunks
+        chatgpt_tokens_per_second.labels(model=model).observe(completion_tokens / (finished_at - first_token_at))
+    return StreamedCompletion(content="".join(parts), usage=usage)
@@ -13,18 +13,40 @@ class ChatGPTTask(SyncAgentExecutorMixin, PythonTask):
 
     _TASK_TYPE = "chatgpt"
 
-    def __init__(self, name: str, chatgpt_config: Dict[str, Any], openai_organization: Optional[str] = None, **kwargs):
+    def __init__(
+        self,
+        name: str,
+        chatgpt_config: Dict[str, Any],
+        openai_organization: Optional[str] = None,
+        batch_window_seconds: Optional[float] = None,
+        cache_nondeterministic: bool = False,
+        stream: bool = False,
+        **kwargs,
+    ):
         """
         Args:
             name: Name of this task, should be unique in the project
             openai_organization: OpenAI Organization. String can be found here. https://platform.openai.com/docs/api-reference/organization-optional
             chatgpt_config: ChatGPT job configuration. Config structure can be found here. https://platform.openai.com/docs/api-reference/completions/create
+            batch_window_seconds: Opt in to request coalescing. The agent waits up to this long to batch concurrent
+                executions of this task, identical messages are then sent only once. Requests whose completion
+                may not be reused, see cache_nondeterministic, are always sent right away.
+            cache_nondeterministic: The agent only reuses the completions of requests sampled at temperature 0,
+                set this to also reuse them when the temperature is higher.
+            stream: Stream the completion. Long answers then only time out when the stream stalls, instead of
+                when the whole answer takes longer than the agent's request timeout.
         """
 
         if "model" not in chatgpt_config:
             raise ValueError("The 'model' configuration variable is required in chatgpt_config")
 
-        task_config = {"openai_organization": openai_organization, "chatgpt_config": chatgpt_config}
+        task_config = {
+            "openai_organization": openai_organization,
+            "chatgpt_config": chatgpt_config,
+            "batch_window_seconds": batch_window_seconds,
+            "cache_nondeterministic": cache_nondeterministic,
+            "stream": stream,
+        }
 
         inputs = {"message": str}
         outputs = {"o0": str}
@@ -38,7 +60,14 @@ class ChatGPTTask(SyncAgentExecutorMixin, PythonTask):
         )
 
     def get_custom(self, settings: SerializationSettings) -> Dict[str, Any]:
-        return {
+        custom = {
             "openai_organization": self.task_config["openai_organization"],
             "chatgpt_config": self.task_config["chatgpt_config"],
         }
+        if self.task_config["batch_window_seconds"] is not None:
+            custom["batch_window_seconds"] = self.task_config["batch_window_seconds"]
+        if self.task_config["cache_nondeterministic"]:
+            custom["cache_nondeterministic"] = True
+        if self.task_config["stream"]:
+            custom["stream"] = True
+        return custom
@@ -4,7 +4,13 @@ PLUGIN_NAME = "openai"
 
 microlib_name = f"flytekitplugins-{PLUGIN_NAME}"
 
-plugin_requires = ["flytekit>1.10.7", "openai>=1.12.0", "flyteidl>=1.11.0"]
+plugin_requires = [
+    "flytekit>1.10.7",
+    "openai>=1.26.0",
+    "prometheus-client",
+    "flyteidl>=1.11.0",
+    "flytekitplugins-agentmetrics",
+]
 
 __version__ = "0.0.0+develop"
 
@@ -1,73 +1,329 @@
 import argparse
-import sys, os, json
+import sys, os, json, time, hashlib, importlib.util, multiprocessing, resource
+from flyteidl.admin import launch_plan_pb2, task_pb2, workflow_pb2
+from flytekit import FlyteContextManager, LaunchPlan
 from flytekit.configuration import SerializationSettings, Config, PlatformConfig, AuthType, ImageConfig
 from flytekit.core.base_task import PythonTask
 from flytekit.core.workflow import WorkflowBase
+from flytekit.exceptions.user import FlyteEntityNotExistException
+from flytekit.models import launch_plan as launch_plan_models, task as task_models
+from flytekit.models.admin import workflow as admin_workflow_models
 from flytekit.remote import FlyteRemote, FlyteTask, FlyteWorkflow
+from flytekit.tools.translator import get_serializable
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import timedelta
+from threading import Lock
 from uuid import uuid4
 from contextlib import contextmanager
-from typing import Union, List
+from types import ModuleType
+from typing import Union, List, Optional, Dict, Tuple
 
 root_directory = os.path.abspath(os.path.dirname(__file__))
 
+# templates share module names (e.g. workflows.example), so only one template may be bound into sys.modules at a time
+module_import_lock = Lock()
+
+# modules of every template imported so far, keyed by template name and then by module name
+template_modules_cache: Dict[str, Dict[str, ModuleType]] = {}
+
+# control plane entities that are handed from serialization workers back to the parent, with their idl messages
+control_plane_entity_types = {
+    "task": (task_models.TaskSpec, task_pb2.TaskSpec),
+    "workflow": (admin_workflow_models.WorkflowSpec, workflow_pb2.WorkflowSpec),
+    "launch_plan": (launch_plan_models.LaunchPlan, launch_plan_pb2.LaunchPlan),
+}
+
+# files that change what a template's image or serialized entities look like, in addition to its python sources
+template_dependency_files = ("requirements.txt", "image-requirements.txt", "pyproject.toml", "uv.lock", "Dockerfile")
+
+
+def template_path(template_name: str) -> str:
+    return os.path.join(root_directory, template_name, "{{cookiecutter.project_name}}")
+
+
+def template_module_files(path: str) -> List[Tuple[str, str, bool]]:
+    """
+    lists (module name, file, is package) for the python modules of a template project,
+    with every package listed before its submodules
+    """
+    modules = []
+    for directory, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if os.path.exists(os.path.join(directory, d, "__init__.py")))
+        package = os.path.relpath(directory, path).replace(os.sep, ".")
+        for filename in sorted(filenames, key=lambda f: (f != "__init__.py", f)):
+            if not filename.endswith(".py"):
+                continue
+            if directory == path:
+                name = filename[:-3]
+            elif filename == "__init__.py":
+                name = package
+            else:
+                name = f"{package}.{filename[:-3]}"
+            modules.append((name, os.path.join(directory, filename), filename == "__init__.py"))
+    return modules
+
+
+def import_template_modules(path: str, loaded: Dict[str, ModuleType]):
+    for name, file_path, is_package in template_module_files(path):
+        if name in sys.modules:
+            # already imported by one of its siblings
+            loaded[name] = sys.modules[name]
+            continue
+        spec = importlib.util.spec_from_file_location(
+            name, file_path, submodule_search_locations=[os.path.dirname(file_path)] if is_package else None)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loaded[name] = module
+        spec.loader.exec_module(module)
+        parent, _, child = name.rpartition(".")
+        if parent:
+            setattr(sys.modules[parent], child, module)
+
 
 @contextmanager
-def workflows_module_management(workflow_name: str):
+def template_modules_management(template_name: str):
     """
-    allows for the import of a workflow module from a path,
-    but imports from the templates root directory; preserving the correct path for imports
+    binds a template's modules into sys.modules for as long as flytekit needs to resolve its entities,
+    importing them from their files on first use and reusing the cached modules afterwards.
+    Modules keep their in-container names (e.g. workflows.example), since flytekit derives entity names and the
+    task resolver arguments from them; modules of other templates with the same names are put back on exit.
     """
-    module_name = "workflows"
-    path = os.path.join(root_directory, workflow_name, "{{cookiecutter.project_name}}")
-    sys.path.insert(0, path)
-    try:
-        yield __import__(module_name)
-    finally:
-        sys.path.remove(path)
-        for name in dir(sys.modules[module_name]):
-            if name.startswith('__'):
+    with module_import_lock:
+        modules = template_modules_cache.get(template_name)
+        path = template_path(template_name)
+        names = list(modules) if modules is not None else [name for name, _, _ in template_module_files(path)]
+        shadowed = {name: sys.modules.pop(name) for name in names if name in sys.modules}
+        loaded = {}
+        try:
+            if modules is None:
+                import_template_modules(path, loaded)
+                template_modules_cache[template_name] = modules = loaded
+            else:
+                sys.modules.update(modules)
+                loaded = modules
+            yield modules
+        finally:
+            for name in loaded:
+                sys.modules.pop(name, None)
+            sys.modules.update(shadowed)
+
+
+def find_template_entity(modules: Dict[str, ModuleType], entity_name: str) -> Union[WorkflowBase, PythonTask]:
+    for module in modules.values():
+        if hasattr(module, entity_name):
+            return getattr(module, entity_name)
+    raise Exception(f"Could not find {entity_name} in modules: {list(modules)}")
+
+
+def template_version(template_name: str, image: str) -> str:
+    """
+    computes a deterministic version for a template from its python sources, its dependency files and the image tag,
+    so an unchanged template is registered under the same version on every run
+    """
+    path = template_path(template_name)
+    digest = hashlib.sha256()
+    for directory, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and d != "__pycache__")
+        for filename in sorted(filenames):
+            if not (filename.endswith(".py") or filename in template_dependency_files):
                 continue
+            file_path = os.path.join(directory, filename)
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, "rb") as f:
+                digest.update(f.read())
+    digest.update(image.encode())
+    return digest.hexdigest()[:32]
+
+
+def load_manifest(manifest_path: str) -> dict:
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path: str, manifest: dict):
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def template_manifest_key(context: FlyteRemote, template: dict) -> str:
+    """
+    manifest entries are kept per cluster endpoint, project and domain, since a version registered on one cluster
+    says nothing about another
+    """
+    return "/".join([context.config.platform.endpoint, "flytetester", "development", template["template_name"],
+                     template["workflow_name"]])
 
-            if name in globals():
-                del globals()[name]
-        if module_name in sys.modules:
-            del sys.modules[module_name]
 
+def fetch_unchanged(context: FlyteRemote, manifest: Optional[dict], manifest_key: str,
+                    version: str) -> Optional[Union[FlyteWorkflow, FlyteTask]]:
+    entry = manifest.get(manifest_key) if manifest is not None else None
+    if entry is None or entry["version"] != version:
+        return None
+    fetch = context.fetch_workflow if entry["type"] == "workflow" else context.fetch_task
+    try:
+        registered = fetch(project="flytetester", domain="development", name=entry["name"], version=version)
+    except FlyteEntityNotExistException:
+        # e.g. the cluster was reset since the manifest was written
+        print(f"{manifest_key} at version: {version} is in the manifest but not on the cluster, registering it again")
+        return None
+    print(f"Skipping registration of unchanged workflow: {manifest_key} at version: {version}")
+    return registered
+
+
+def register_template(context: FlyteRemote, template: dict, image_hostname: str, image_suffix: str,
+                      version: Optional[str] = None, manifest: Optional[dict] = None) -> Union[FlyteWorkflow, FlyteTask]:
+    """
+    registers a single template entry; without a version the template is versioned by its content hash, and
+    entities already recorded in the manifest under that version are fetched instead of registered again
+    """
+    template_name = template["template_name"]
+    workflow_name = template["workflow_name"]
+    image = f"{image_hostname}:{template_name}-{image_suffix}"
+    if version is None:
+        version = template_version(template_name, image)
+    manifest_key = template_manifest_key(context, template)
+    registered = fetch_unchanged(context, manifest, manifest_key, version)
+    if registered is not None:
+        return registered
+
+    settings = SerializationSettings(image_config=ImageConfig.from_images(image), project="flytetester",
+                                     domain="development", version=version)
+    # only the imports and serialization need the template's modules, the network calls run without the lock
+    serialized = serialize_template(template_name, workflow_name, settings)
+    print(serialized["name"])
+    print(f"Registering workflow: {template_name} with image: {image}")
+    for cp_entity in serialized["entities"].values():
+        context.raw_register(cp_entity, settings, version, create_default_launchplan=False)
+    fetch = context.fetch_workflow if serialized["type"] == "workflow" else context.fetch_task
+    reg_workflow = fetch(project="flytetester", domain="development", name=serialized["name"], version=version)
+    print(f"Registered workflow: {template_name}")
+    if manifest is not None:
+        manifest[manifest_key] = {"version": version, "name": serialized["name"], "type": serialized["type"]}
+    return reg_workflow
+
+
+def serialize_template(template_name: str, workflow_name: str, settings: SerializationSettings) -> dict:
+    """
+    serializes a template's workflow with its default launch plan, or its task, into control plane entities;
+    the template's modules are only bound into sys.modules, under the import lock, while this runs
+    """
+    import_start = time.monotonic()
+    with template_modules_management(template_name) as modules:
+        imported = time.monotonic()
+        workflow = find_template_entity(modules, workflow_name)
+        if isinstance(workflow, WorkflowBase):
+            entity_type = "workflow"
+            target = LaunchPlan.get_default_launch_plan(FlyteContextManager.current_context(), workflow)
+        elif isinstance(workflow, PythonTask):
+            entity_type = "task"
+            target = workflow
+        else:
+            raise Exception("Unknown workflow type")
+        entities = OrderedDict()
+        get_serializable(entities, settings, target)
+    return {"type": entity_type, "name": workflow.name, "entities": entities,
+            "import_seconds": imported - import_start, "serialize_seconds": time.monotonic() - imported}
 
-def register_all(context: FlyteRemote, templates: List[dict], image_hostname: str, image_suffix: str):
 
-    version = str(uuid4())
+def register_all(context: FlyteRemote, templates: List[dict], image_hostname: str, image_suffix: str,
+                 manifest: Optional[dict] = None):
+    """
+    registers every template under one random version, or under per-template content versions when a manifest of
+    previously registered entities is given
+    """
+    version = None if manifest is not None else str(uuid4())
     registered_workflows = []
+    for template in templates:
+        registered_workflows.append(
+            register_template(context, template, image_hostname, image_suffix, version, manifest))
+    return registered_workflows
+
+
+def serialize_template_shard(templates: List[dict], image_hostname: str, image_suffix: str,
+                             version: Optional[str]) -> dict:
+    """
+    process pool entry point: imports and serializes the templates of one shard and returns the control plane
+    entities as idl bytes, so the heavy template imports never happen in the process that does the registration
+    """
+    serialized = []
     for template in templates:
         template_name = template["template_name"]
-        workflow_name = template["workflow_name"]
-        with workflows_module_management(template_name) as wf_module:
-            workflow = getattr(wf_module, workflow_name)
-            print(workflow.name)
-            image = f"{image_hostname}:{template_name}-{image_suffix}"
-            print(f"Registering workflow: {template_name} with image: {image}")
-            if isinstance(workflow, WorkflowBase):
-                reg_workflow = context.register_workflow(
-                    entity=workflow,
-                    serialization_settings=SerializationSettings(image_config=ImageConfig.from_images(image),
-                                                                 project="flytetester",
-                                                                 domain="development"),
-                    version=version,
-                )
-            elif isinstance(workflow, PythonTask):
-                reg_workflow = context.register_task(
-                    entity=workflow,
-                    serialization_settings=SerializationSettings(image_config=ImageConfig.from_images(image),
-                                                                 project="flytetester",
-                                                                 domain="development"),
-                    version=version,
-                )
+        image = f"{image_hostname}:{template_name}-{image_suffix}"
+        entity_version = version or template_version(template_name, image)
+        settings = SerializationSettings(image_config=ImageConfig.from_images(image), project="flytetester",
+                                         domain="development", version=entity_version)
+        result = serialize_template(template_name, template["workflow_name"], settings)
+        entities_bytes = []
+        for entity_id, cp_entity in result["entities"].items():
+            for kind, (model_type, _) in control_plane_entity_types.items():
+                if isinstance(cp_entity, model_type):
+                    entities_bytes.append((kind, cp_entity.to_flyte_idl().SerializeToString()))
+                    break
             else:
-                raise Exception("Unknown workflow type")
-            print(f"Registered workflow: {template_name}")
-            registered_workflows.append(reg_workflow)
-    return registered_workflows
+                # registering the rest of the template without it would leave it incomplete on the cluster
+                raise TypeError(f"Cannot hand {type(cp_entity).__name__} {entity_id} of template {template_name} "
+                                f"back to the registering process")
+        serialized.append({"template": template, "version": entity_version, "name": result["name"],
+                           "type": result["type"], "entities": entities_bytes,
+                           "import_seconds": result["import_seconds"],
+                           "serialize_seconds": result["serialize_seconds"]})
+    return {"pid": os.getpid(), "templates": serialized,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def register_all_sharded(context: FlyteRemote, templates: List[dict], image_hostname: str, image_suffix: str,
+                         workers: int, manifest: Optional[dict] = None) -> List[Union[FlyteWorkflow, FlyteTask]]:
+    """
+    shards the templates across a process pool, one shard per template so each heavy import happens once and in a
+    fresh worker; the parent only registers the serialized entities, which keeps its memory flat
+    """
+    version = None if manifest is not None else str(uuid4())
+    registered = {}
+    shards = OrderedDict()
+    for template in templates:
+        template_name = template["template_name"]
+        manifest_key = template_manifest_key(context, template)
+        image = f"{image_hostname}:{template_name}-{image_suffix}"
+        unchanged = fetch_unchanged(context, manifest, manifest_key, version or template_version(template_name, image))
+        if unchanged is not None:
+            registered[manifest_key] = unchanged
+        else:
+            shards.setdefault(template_name, []).append(template)
+
+    # spawn, since forking a process that already holds grpc channels is unsafe
+    pool_options = {"max_workers": workers, "mp_context": multiprocessing.get_context("spawn")}
+    if sys.version_info >= (3, 11):
+        # a fresh worker per shard, so no worker keeps the modules of a template it has already serialized
+        pool_options["max_tasks_per_child"] = 1
+    with ProcessPoolExecutor(**pool_options) as pool:
+        futures = [pool.submit(serialize_template_shard, shard, image_hostname, image_suffix, version)
+                   for shard in shards.values()]
+        for future in as_completed(futures):
+            result = future.result()
+            for entry in result["templates"]:
+                template = entry["template"]
+                manifest_key = template_manifest_key(context, template)
+                print(f"Worker {result['pid']} serialized {manifest_key}: import {entry['import_seconds']:.1f}s, "
+                      f"serialize {entry['serialize_seconds']:.1f}s, peak rss {result['peak_rss_mb']:.0f}MB")
+                settings = SerializationSettings(
+                    image_config=ImageConfig.from_images(
+                        f"{image_hostname}:{template['template_name']}-{image_suffix}"),
+                    project="flytetester", domain="development", version=entry["version"])
+                for kind, entity_bytes in entry["entities"]:
+                    model_type, idl_type = control_plane_entity_types[kind]
+                    cp_entity = model_type.from_flyte_idl(idl_type.FromString(entity_bytes))
+                    context.raw_register(cp_entity, settings, entry["version"], create_default_launchplan=False)
+                fetch = context.fetch_workflow if entry["type"] == "workflow" else context.fetch_task
+                registered[manifest_key] = fetch(project="flytetester", domain="development", name=entry["name"],
+                                                 version=entry["version"])
+                print(f"Registered workflow: {template['template_name']}")
+                if manifest is not None:
+                    manifest[manifest_key] = {"version": entry["version"], "name": entry["name"],
+                                              "type": entry["type"]}
+    return [registered[template_manifest_key(context, template)] for template in templates]
 
 
 def execute_all(remote_context: FlyteRemote, reg_workflows: List[Union[FlyteWorkflow, FlyteTask]]):
@@ -82,6 +338,81 @@ def execute_all(remote_context: FlyteRemote, reg_workflows: List[Union[FlyteWork
             print(f"Execution succeeded: {completed_execution.outputs}")
 
 
+def run_all_concurrently(context: FlyteRemote, templates: List[dict], image_hostname: str, image_suffix: str,
+                         max_workers: int, manifest: Optional[dict] = None, timeout: timedelta = timedelta(minutes=10),
+                         poll_interval: timedelta = timedelta(seconds=10)):
+    """
+    registers the templates from a thread pool and launches each execution as soon as its registration finishes,
+    then polls all executions together; the run takes as long as the slowest template instead of the sum of all of them
+    """
+    version = None if manifest is not None else str(uuid4())
+    started = time.monotonic()
+
+    def register_and_launch(template: dict):
+        reg_start = time.monotonic()
+        reg_workflow = register_template(context, template, image_hostname, image_suffix, version, manifest)
+        registered = time.monotonic()
+        print(f"Executing workflow: {reg_workflow.id}")
+        execution = context.execute(reg_workflow, inputs={}, project="flytetester", domain="development")
+        print(f"Execution url: {context.generate_console_url(execution)}")
+        return {"label": f"{template['template_name']}/{template['workflow_name']}",
+                "register_seconds": registered - reg_start, "launched": time.monotonic(), "execution": execution}
+
+    runs = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(register_and_launch, template) for template in templates]
+        for future in as_completed(futures):
+            runs.append(future.result())
+    print("All workflows Registered")
+
+    wait_for_all(context, runs, started, timeout, poll_interval)
+
+
+def launch_all(context: FlyteRemote, templates: List[dict], reg_workflows: List[Union[FlyteWorkflow, FlyteTask]],
+               timeout: timedelta = timedelta(minutes=10), poll_interval: timedelta = timedelta(seconds=10)):
+    """
+    launches every registered workflow at once and polls them together
+    """
+    started = time.monotonic()
+    runs = []
+    for template, reg_workflow in zip(templates, reg_workflows):
+        print(f"Executing workflow: {reg_workflow.id}")
+        execution = context.execute(reg_workflow, inputs={}, project="flytetester", domain="development")
+        print(f"Execution url: {context.generate_console_url(execution)}")
+        runs.append({"label": f"{template['template_name']}/{template['workflow_name']}", "register_seconds": 0.0,
+                     "launched": time.monotonic(), "execution": execution})
+    wait_for_all(context, runs, started, timeout, poll_interval)
+
+
+def wait_for_all(context: FlyteRemote, runs: List[dict], started: float, timeout: timedelta, poll_interval: timedelta):
+    pending = list(runs)
+    deadline = time.monotonic() + timeout.total_seconds()
+    while pending:
+        for run in list(pending):
+            run["execution"] = context.sync_execution(run["execution"])
+            if run["execution"].is_done:
+                run["run_seconds"] = time.monotonic() - run["launched"]
+                pending.remove(run)
+        if not pending:
+            break
+        if time.monotonic() > deadline:
+            raise Exception(f"Executions did not complete before timeout: {[run['label'] for run in pending]}")
+        time.sleep(poll_interval.total_seconds())
+
+    print(f"{'template':<50} {'register (s)':>12} {'execute (s)':>12}")
+    for run in sorted(runs, key=lambda r: r["label"]):
+        print(f"{run['label']:<50} {run['register_seconds']:>12.1f} {run['run_seconds']:>12.1f}")
+    print(f"Total wall time: {time.monotonic() - started:.1f}s")
+
+    failed = [run for run in runs if run["execution"].error is not None]
+    for run in failed:
+        print(f"Execution failed: {run['label']} with error: {run['execution'].error}")
+    if failed:
+        raise Exception(f"{len(failed)} executions failed")
+    for run in runs:
+        print(f"Execution succeeded: {run['label']} {run['execution'].outputs}")
+
+
 if __name__ == "__main__":
     """
     This program takes a remote cluster, registers all templates on it - and then returns a url to the workflow on the Flyte Cluster.
@@ -92,6 +423,14 @@ if __name__ == "__main__":
     parser.add_argument("--insecure", type=bool, default=False)
     parser.add_argument("--image_hostname", type=str, default="ghcr.io/flyteorg/flytekit-python-template")
     parser.add_argument("--image_suffix", type=str, default="latest")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="register templates in parallel and run all executions at the same time")
+    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument("--content_versioning", action="store_true",
+                        help="version templates by content hash and skip registering entities recorded in the manifest")
+    parser.add_argument("--manifest", type=str, default=".registration_manifest.json")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="import and serialize templates in this many worker processes instead of in-process")
     args, _ = parser.parse_known_args()
     auth_type = getattr(AuthType, args.auth_type)
     client_credential_parser = argparse.ArgumentParser(parents=[parser], add_help=False)
@@ -113,7 +452,25 @@ if __name__ == "__main__":
     with open('templates.json') as f:
         templates_list = json.load(f)
     print(templates_list)
-    remote_wfs = register_all(remote, templates_list, args.image_hostname, args.image_suffix)
-    print("All workflows Registered")
-    execute_all(remote, remote_wfs)
+    registration_manifest = load_manifest(args.manifest) if args.content_versioning else None
+    try:
+        if args.workers > 0:
+            remote_wfs = register_all_sharded(remote, templates_list, args.image_hostname, args.image_suffix,
+                                              args.workers, registration_manifest)
+            print("All workflows Registered")
+            if args.concurrent:
+                launch_all(remote, templates_list, remote_wfs)
+            else:
+                execute_all(remote, remote_wfs)
+        elif args.concurrent:
+            run_all_concurrently(remote, templates_list, args.image_hostname, args.image_suffix, args.max_workers,
+                                 registration_manifest)
+        else:
+            remote_wfs = register_all(remote, templates_list, args.image_hostname, args.image_suffix,
+                                      registration_manifest)
+            print("All workflows Registered")
+            execute_all(remote, remote_wfs)
+    finally:
+        if registration_manifest is not None:
+            save_manifest(args.manifest, registration_manifest)
     print("All executions completed")
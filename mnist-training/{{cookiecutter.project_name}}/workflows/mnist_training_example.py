@@ -1,7 +1,25 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from dataclasses_json import dataclass_json
 import torch
-from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
-from flytekit import task, workflow, Resources
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import BatchSampler, DataLoader, Dataset, DistributedSampler, RandomSampler, SequentialSampler
+from torchvision import datasets
+from flytekit import current_context, dynamic, logger, task, workflow, Resources
+from flytekit.types.directory import FlyteDirectory
+from flytekitplugins.kfpytorch import Elastic
 import torch as th
 from torch import nn
 
@@ -10,61 +28,174 @@ This example is a simple MNIST training example. It uses the PyTorch framework t
 The model is trained for 10 epochs and the validation loss is calculated on the test set.
 """
 
+MNIST_ROOT = "/tmp/mnist"
+# Bump this when the layout of the tensor files changes, so that cached datasets are rebuilt
+DATASET_VERSION = "1"
+BATCH_SIZE = 64
+# Evaluation has no gradients to keep, so it runs in much larger batches than training
+EVAL_BATCH_SIZE = 2048
+# How a trained model's weights are stored, see save_model
+MODEL_PRECISIONS = ("float32", "float16", "bfloat16", "int8")
+# Offsets of the tensors in a model's weights file are aligned to this many bytes
+MODEL_ALIGNMENT = 64
+# Attempts a training task gets after the first, each resumes from the last checkpoint of the one before
+TRAINING_RETRIES = 3
 
-@task(requests=Resources(cpu="1", mem="1Gi", ephemeral_storage="10Gi"))
-def get_dataset(training: bool, gpu: bool = False) -> DataLoader:
+
+@dataclass_json
+@dataclass
+class LoaderSpec(object):
     """
-    This task downloads the MNIST dataset and returns a dataloader for the dataset.
-    If GPU is enabled, the dataloader is configured to use the GPU.
-    :return: A dataloader for the MNIST dataset.
+    How a task loads a dataset written by get_dataset. By default the batches are prepared by one worker process
+    per core available to the task, minus the core that runs the training loop. The workers stay alive between
+    epochs and each keeps prefetch_factor batches ready.
     """
-    dataset = datasets.MNIST("/tmp/mnist", train=training, download=True, transform=transforms.ToTensor())
-    if gpu and training is True:
-        dataloader = DataLoader(dataset, batch_size=64, shuffle=True, pin_memory_device="cuda", pin_memory=True)
-    else:
-        dataloader = DataLoader(dataset, batch_size=64, shuffle=True)
-    return dataloader
+    batch_size: int = BATCH_SIZE
+    shuffle: bool = True
+    num_workers: Optional[int] = None
+    prefetch_factor: int = 4
+    persistent_workers: bool = True
+
+
+@dataclass_json
+@dataclass
+class ValidationMetrics(object):
+    """
+    How a model does on the test set: the mean NLL loss and the fraction of correct predictions over all samples.
+    """
+    loss: float
+    accuracy: float
+    samples: int
+
+
+@dataclass_json
+@dataclass
+class ModelSpec(object):
+    """
+    The architecture get_model_architecture builds. It is stored with the weights of a trained model, so that the
+    model can be rebuilt from the artifact alone.
+    """
+    conv1_channels: int = 16
+    conv2_channels: int = 32
+    hidden_units: int = 128
+    classes: int = 10
+
+
+@task(requests=Resources(cpu="1", mem="1Gi", ephemeral_storage="10Gi"), cache=True, cache_version=DATASET_VERSION)
+def get_dataset(training: bool) -> FlyteDirectory:
+    """
+    This task downloads the MNIST dataset and converts it once into contiguous uint8 tensor files.
+    The files are written to a directory named after the hash of their content, so an unchanged dataset is not
+    written again, and the task is cached so later runs skip it altogether.
+    :return: A directory with images.npy (N x 1 x 28 x 28 uint8) and labels.npy (N int64).
+    """
+    mnist = datasets.MNIST(MNIST_ROOT, train=training, download=True)
+    images = np.ascontiguousarray(mnist.data.unsqueeze(1).numpy())
+    labels = np.ascontiguousarray(mnist.targets.numpy())
+    digest = hashlib.sha256()
+    digest.update(images)
+    digest.update(labels)
+    path = os.path.join(MNIST_ROOT, "tensors", f"{'train' if training else 'test'}-{digest.hexdigest()[:16]}")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, "images.npy"), images)
+        np.save(os.path.join(tmp_path, "labels.npy"), labels)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another run wrote the same content first
+            shutil.rmtree(tmp_path)
+    return FlyteDirectory(path)
 
 
-@task(requests=Resources(cpu="2", mem="10Gi", ephemeral_storage="10Gi"))
-def train_cpu(dataset: DataLoader, n_epochs: int) -> th.nn.Sequential:
+@task(requests=Resources(cpu="2", mem="10Gi", ephemeral_storage="10Gi"), retries=TRAINING_RETRIES)
+def train_cpu(
+    dataset: FlyteDirectory, loader: LoaderSpec, n_epochs: int, workers: int = 0, precision: str = "float32"
+) -> FlyteDirectory:
     """
     This task trains the model for the specified number of epochs.
     This variant of the task uses the CPU for training. as you can see from the Resources requested in the task decorator.
+    Training is data-parallel over `workers` processes, by default one for every core the task requested.
+    The model and optimizer are checkpointed after every epoch, and a retry resumes from the last checkpoint.
+    :return: The model artifact written by save_model, with its weights stored in the given precision.
     """
-    model, optim = get_model_architecture()
-    return train_model(model=model, optim=optim, dataset=dataset, n_epochs=n_epochs)
+    check_precision(precision)
+    model, _ = train_data_parallel(dataset.download(), loader, n_epochs, workers)
+    return export_model(model, precision)
+
+
+@task(
+    task_config=Elastic(nnodes=2, nproc_per_node=2),
+    requests=Resources(cpu="2", mem="10Gi", ephemeral_storage="10Gi"),
+    retries=TRAINING_RETRIES,
+)
+def train_cpu_multinode(
+    dataset: FlyteDirectory, loader: LoaderSpec, n_epochs: int, precision: str = "float32"
+) -> FlyteDirectory:
+    """
+    This task trains the model data-parallel on two nodes with two processes each.
+    The PyTorch plugin starts the processes and calls this task in every one of them, the model artifact of the
+    first process is the output of the task.
+    """
+    check_precision(precision)
+    model, _ = train_data_parallel(dataset.download(), loader, n_epochs)
+    return export_model(model, precision)
+
+
+@task(requests=Resources(cpu="4", mem="10Gi", ephemeral_storage="10Gi"))
+def cpu_throughput(dataset: FlyteDirectory, loader: LoaderSpec, n_epochs: int, workers: int) -> float:
+    """
+    This task trains the model with the given number of worker processes, only to measure the samples per second.
+    It does not checkpoint, so that every measurement trains all epochs.
+    """
+    _, samples_per_second = train_data_parallel(dataset.download(), loader, n_epochs, workers, checkpoint=False)
+    return samples_per_second
 
 
-@task(requests=Resources(gpu="1", mem="10Gi", ephemeral_storage="10Gi"))
-def train_gpu(dataset: DataLoader, n_epochs: int) -> th.nn.Sequential:
+@task(requests=Resources(cpu="4", gpu="1", mem="10Gi", ephemeral_storage="10Gi"), retries=TRAINING_RETRIES)
+def train_gpu(
+    dataset: FlyteDirectory, loader: LoaderSpec, n_epochs: int, precision: str = "float32"
+) -> FlyteDirectory:
     """
     This task trains the model for the specified number of epochs.
     This variant of the task uses the GPU for training. as you can see from the Resources requested in the task decorator.
+    The requested cores feed the GPU, they run the loader workers that prepare the next batches.
+    The model and optimizer are checkpointed after every epoch, and a retry resumes from the last checkpoint.
+    :return: The model artifact written by save_model, with its weights stored in the given precision.
     """
+    check_precision(precision)
     model, optim = get_model_architecture()
-    return train_model(model=model, optim=optim, dataset=dataset, n_epochs=n_epochs)
+    train_model(
+        model=model,
+        optim=optim,
+        dataset=make_loader(dataset.download(), loader),
+        n_epochs=n_epochs,
+        checkpointer=Checkpointer.for_task(),
+    )
+    return export_model(model, precision)
 
 
 @task(requests=Resources(cpu="2", mem="10Gi", ephemeral_storage="15Gi"))
-def validation_loss(model: th.nn.Sequential, dataset: DataLoader) -> str:
+def validation_loss(model: FlyteDirectory, dataset: FlyteDirectory, loader: LoaderSpec) -> ValidationMetrics:
     """
-    This task calculates the validation loss on the test set.
-    This is always run in CPU mode, regardless of the GPU setting. It simply returns the NNL Model Loss on the test set.
+    This task calculates the validation loss and accuracy on the test set.
+    This is always run in CPU mode, regardless of the GPU setting. The test set is read by make_loader as
+    configured by `loader`, and the summed loss and correct predictions stay tensors until the last batch.
     """
-    model.to("cpu").eval()
-    losses = []
-    with torch.no_grad():
-        for data, target in dataset:
-            data, target = data.to("cpu"), target.to("cpu")
-            output = model.forward(data)
-            loss = th.nn.functional.nll_loss(output, target)
-            losses.append(loss.item())
-    loss = 0
-    for l in losses:
-        loss += l
-    loss = loss / len(losses)
-    return "NLL model loss in test set: " + str(loss)
+    model = load_model(model.download()).eval()
+    batches = make_loader(dataset.download(), loader)
+    loss = th.zeros((), dtype=th.float64)
+    correct = th.zeros((), dtype=th.int64)
+    with th.inference_mode():
+        for data, target in batches:
+            output = model(data)
+            loss += th.nn.functional.nll_loss(output, target, reduction="sum")
+            correct += (output.argmax(dim=1) == target).sum()
+    samples = len(batches.dataset)
+    metrics = ValidationMetrics(loss=loss.item() / samples, accuracy=correct.item() / samples, samples=samples)
+    logger.info(f"NLL model loss in test set: {metrics.loss:.4f}, accuracy: {metrics.accuracy:.2%}")
+    return metrics
 
 
 
@@ -73,17 +204,184 @@ General Functions, used by Tasks
 """
 
 
-def train_model(model: th.nn.Sequential, optim: th.optim.Optimizer, dataset: DataLoader,
-                n_epochs: int) -> th.nn.Sequential:
+class MNISTTensorDataset(Dataset):
+    """
+    Memory-maps the tensor files written by get_dataset, so opening the dataset reads nothing up front.
+    Indexing with a list of indices returns a whole batch with one vectorized slice, scaled to [0, 1] like
+    transforms.ToTensor, instead of converting every sample on its own.
+    """
+
+    def __init__(self, path: str):
+        # copy-on-write mapping, the tensors share the file's pages without making them read-only for torch
+        self.images = th.from_numpy(np.load(os.path.join(path, "images.npy"), mmap_mode="c"))
+        self.labels = th.from_numpy(np.load(os.path.join(path, "labels.npy"), mmap_mode="c"))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        return self.images[index].float().div_(255), self.labels[index]
+
+
+def available_cpus() -> int:
+    """
+    Returns the number of cores the task may use. In a container that is the CPU limit of its cgroup, which Flyte
+    derives from the task's Resources, while os.cpu_count() returns the cores of the whole node.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def make_loader(
+    path: str, spec: LoaderSpec, rank: int = 0, world_size: int = 1, local_world_size: int = 1
+) -> DataLoader:
+    """
+    Returns a loader that yields whole batches of the dataset, each fetched with a single index into it.
+    In data-parallel training every one of the world_size processes gets its own shard of the dataset, and the
+    local_world_size processes on a node split its cores between their loader workers.
+    """
+    tensors = MNISTTensorDataset(path)
+    if world_size > 1:
+        sampler = DistributedSampler(tensors, num_replicas=world_size, rank=rank, shuffle=spec.shuffle)
+    else:
+        sampler = RandomSampler(tensors) if spec.shuffle else SequentialSampler(tensors)
+    num_workers = spec.num_workers
+    if num_workers is None:
+        # more training processes than cores leaves no core for loader workers, the batches are then loaded inline
+        num_workers = max(0, available_cpus() // local_world_size - 1)
+    worker_options = {}
+    if num_workers > 0:
+        worker_options = {"persistent_workers": spec.persistent_workers, "prefetch_factor": spec.prefetch_factor}
+    return DataLoader(
+        tensors,
+        batch_size=None,
+        sampler=BatchSampler(sampler, spec.batch_size, drop_last=False),
+        num_workers=num_workers,
+        pin_memory=th.cuda.is_available(),
+        **worker_options,
+    )
+
+
+def _detached_copy(state):
+    if isinstance(state, th.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {k: _detached_copy(v) for k, v in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_detached_copy(v) for v in state)
+    return state
+
+
+class Checkpointer(object):
+    """
+    Saves the training state after every epoch, so that a retry of the task resumes where the failed attempt stopped.
+    `previous` is the serialized checkpoint of the failed attempt, if there is one, and `sink` stores a serialized
+    checkpoint. Checkpoints are serialized and stored in a background thread, the training loop only waits for the
+    tensors to be copied. When the previous checkpoint is still being stored, the next one is skipped, unless it is
+    the final one, which waits for it so that the finished training is always checkpointed.
+    """
+
+    def __init__(self, previous: Optional[bytes] = None, sink: Optional[Callable[[bytes], None]] = None):
+        self.previous = previous
+        self.sink = sink
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending: Optional[Future] = None
+
+    @classmethod
+    def for_task(cls, write: bool = True) -> "Checkpointer":
+        """
+        Uses the checkpoint Flyte keeps for every task attempt under the task's raw output prefix. A retry can read
+        the checkpoint of the attempt before it. Only one of the processes of a data-parallel task should write.
+        """
+        try:
+            checkpoint = current_context().checkpoint
+        except NotImplementedError:
+            # the platform or the process running the task does not provide a checkpoint location
+            checkpoint = None
+        if checkpoint is None:
+            return cls()
+        return cls(previous=checkpoint.read(), sink=checkpoint.write if write else None)
+
+    def restore(self) -> Optional[dict]:
+        if self.previous is None:
+            return None
+        return th.load(io.BytesIO(self.previous), map_location="cpu")
+
+    def save(self, state: dict, final: bool = False):
+        if self.sink is None:
+            return
+        if self._pending is not None and not self._pending.done():
+            if not final:
+                logger.info("Skipping a checkpoint, the previous one is still being written")
+                return
+            self._pending.result()
+        self._pending = self._executor.submit(self._store, _detached_copy(state))
+
+    def _store(self, state: dict):
+        buffer = io.BytesIO()
+        th.save(state, buffer)
+        try:
+            self.sink(buffer.getvalue())
+        except Exception as e:
+            logger.warning(f"Failed to write a checkpoint after epoch {state['epoch']}: {e}")
+
+    def close(self):
+        """
+        Waits until the last checkpoint is stored.
+        """
+        if self._pending is not None:
+            self._pending.result()
+        self._executor.shutdown()
+
+
+def train_model(
+    model: th.nn.Module,
+    optim: th.optim.Optimizer,
+    dataset: DataLoader,
+    n_epochs: int,
+    checkpointer: Optional[Checkpointer] = None,
+) -> float:
     """
     This function runs the inner training loop for the specified number of epochs.
     If a GPU is available, the model is moved to the GPU and the training is done on the GPU.
+    With a checkpointer it resumes after the last epoch of its previous checkpoint, and checkpoints every epoch.
+    It returns the samples per second of all data-parallel workers together.
     """
     if th.cuda.is_available():
         model.to("cuda").train()
     else:
         model.train()
-    for epoch in range(n_epochs):
+    # the checkpoint holds the weights of the plain model, also when it is wrapped in DistributedDataParallel
+    module = getattr(model, "module", model)
+    start_epoch = 0
+    state = checkpointer.restore() if checkpointer is not None else None
+    if state is not None:
+        module.load_state_dict(state["model"])
+        optim.load_state_dict(state["optimizer"])
+        start_epoch = min(state["epoch"], n_epochs)
+        logger.info(f"Resuming training after epoch {start_epoch} of {n_epochs}")
+    sampler = getattr(dataset.sampler, "sampler", None)
+    samples = 0
+    started_at = time.perf_counter()
+    for epoch in range(start_epoch, n_epochs):
+        if isinstance(sampler, DistributedSampler):
+            # reshuffles the shards differently every epoch
+            sampler.set_epoch(epoch)
         for data, target in dataset:
             if th.cuda.is_available():
                 data, target = data.to("cuda"), target.to("cuda")
@@ -92,51 +390,311 @@ def train_model(model: th.nn.Sequential, optim: th.optim.Optimizer, dataset: Dat
             loss = th.nn.functional.nll_loss(output, target)
             loss.backward()
             optim.step()
-    return model
+            samples += len(target)
+        if checkpointer is not None:
+            checkpointer.save(
+                {"epoch": epoch + 1, "model": module.state_dict(), "optimizer": optim.state_dict()},
+                final=epoch + 1 == n_epochs,
+            )
+    elapsed = time.perf_counter() - started_at
+    if checkpointer is not None:
+        checkpointer.close()
+
+    workers = 1
+    if dist.is_initialized():
+        workers = dist.get_world_size()
+        totals = th.tensor([float(samples)])
+        dist.all_reduce(totals)
+        slowest = th.tensor([elapsed])
+        dist.all_reduce(slowest, op=dist.ReduceOp.MAX)
+        samples, elapsed = totals.item(), slowest.item()
+    samples_per_second = samples / elapsed
+    logger.info(
+        f"Trained at {samples_per_second:.0f} samples/s with {workers} worker(s), "
+        f"{samples_per_second / workers:.0f} samples/s per worker"
+    )
+    return samples_per_second
+
+
+def launched_by_elastic() -> bool:
+    # set by torchrun, which the PyTorch plugin's Elastic task config uses to start the processes
+    return "RANK" in os.environ and "WORLD_SIZE" in os.environ
+
+
+def train_data_parallel(
+    path: str, spec: LoaderSpec, n_epochs: int, workers: int = 0, checkpoint: bool = True
+) -> Tuple[th.nn.Sequential, float]:
+    """
+    This function trains the model in `workers` processes, by default one per available core. Every process trains
+    on its own shard of each epoch, and DistributedDataParallel averages the gradients over the gloo backend.
+    When the processes were already started by the PyTorch plugin, it runs as one of them.
+    With `checkpoint`, every process resumes from the task's last checkpoint, and the first one writes new ones.
+    It returns the trained model and the samples per second of all workers together.
+    """
+    if launched_by_elastic():
+        dist.init_process_group("gloo")
+        try:
+            checkpointer = Checkpointer.for_task(write=dist.get_rank() == 0) if checkpoint else None
+            return _train_rank(path, spec, n_epochs, checkpointer)
+        finally:
+            dist.destroy_process_group()
+
+    workers = workers or available_cpus()
+    checkpointer = Checkpointer.for_task() if checkpoint else Checkpointer()
+    if workers == 1:
+        model, optim = get_model_architecture()
+        samples_per_second = train_model(
+            model=model, optim=optim, dataset=make_loader(path, spec), n_epochs=n_epochs, checkpointer=checkpointer
+        )
+        return model, samples_per_second
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    # only this process has the task's checkpoint location, the first worker sends its checkpoints here to be stored
+    checkpoints = mp.get_context("spawn").SimpleQueue() if checkpointer.sink is not None else None
+    with tempfile.TemporaryDirectory() as result_dir:
+        args = (workers, port, path, spec, n_epochs, result_dir, checkpointer.previous, checkpoints)
+        processes = mp.spawn(_train_worker, args=args, nprocs=workers, join=False)
+        while not processes.join(timeout=1):
+            _store_checkpoints(checkpoints, checkpointer)
+        _store_checkpoints(checkpoints, checkpointer)
+        result = th.load(os.path.join(result_dir, "result.pt"))
+    model, _ = get_model_architecture()
+    model.load_state_dict(result["state_dict"])
+    return model, result["samples_per_second"]
+
+
+def _store_checkpoints(checkpoints, checkpointer: Checkpointer):
+    while checkpoints is not None and not checkpoints.empty():
+        checkpointer.sink(checkpoints.get())
+
 
-def get_model_architecture() -> (th.nn.Sequential, th.optim.Optimizer):
+def _train_worker(
+    rank: int,
+    world_size: int,
+    port: int,
+    path: str,
+    spec: LoaderSpec,
+    n_epochs: int,
+    result_dir: str,
+    previous_checkpoint: Optional[bytes],
+    checkpoints,
+):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        sink = checkpoints.put if rank == 0 and checkpoints is not None else None
+        checkpointer = Checkpointer(previous=previous_checkpoint, sink=sink)
+        model, samples_per_second = _train_rank(path, spec, n_epochs, checkpointer)
+        if rank == 0:
+            result = {"state_dict": model.state_dict(), "samples_per_second": samples_per_second}
+            th.save(result, os.path.join(result_dir, "result.pt"))
+    finally:
+        dist.destroy_process_group()
+
+
+def _train_rank(
+    path: str, spec: LoaderSpec, n_epochs: int, checkpointer: Optional[Checkpointer] = None
+) -> Tuple[th.nn.Sequential, float]:
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", dist.get_world_size()))
+    # the processes on a node share its cores, each gets its own slice for its intra-op threads
+    th.set_num_threads(max(1, available_cpus() // local_world_size))
+    model, optim = get_model_architecture()
+    loader = make_loader(path, spec, dist.get_rank(), dist.get_world_size(), local_world_size)
+    samples_per_second = train_model(
+        model=DistributedDataParallel(model), optim=optim, dataset=loader, n_epochs=n_epochs, checkpointer=checkpointer
+    )
+    return model, samples_per_second
+
+
+def get_model_architecture(spec: Optional[ModelSpec] = None) -> (th.nn.Sequential, th.optim.Optimizer):
+    spec = spec or ModelSpec()
     model = nn.Sequential(
-        nn.Conv2d(1, 16, kernel_size=3, padding=1),
+        nn.Conv2d(1, spec.conv1_channels, kernel_size=3, padding=1),
         nn.ReLU(),
         nn.MaxPool2d(kernel_size=2),
-        nn.Conv2d(16, 32, kernel_size=3, padding=1),
+        nn.Conv2d(spec.conv1_channels, spec.conv2_channels, kernel_size=3, padding=1),
         nn.ReLU(),
         nn.MaxPool2d(kernel_size=2),
         nn.Flatten(),
-        nn.Linear(32 * 7 * 7, 128),
+        nn.Linear(spec.conv2_channels * 7 * 7, spec.hidden_units),
         nn.ReLU(),
-        nn.Linear(128, 10)
+        nn.Linear(spec.hidden_units, spec.classes)
     )
     optimizer = th.optim.SGD(model.parameters(), lr=0.003, momentum=0.9)
     return model, optimizer
 
 
+def check_precision(precision: str):
+    if precision not in MODEL_PRECISIONS:
+        raise ValueError(f"Unknown model precision {precision!r}, expected one of {', '.join(MODEL_PRECISIONS)}")
+
+
+def _encode_tensor(name: str, tensor: th.Tensor, precision: str):
+    """
+    Yields the tensors a state_dict entry is stored as, with their index entries. Weights with more than one
+    dimension are stored as int8 with one float32 scale per output channel in the int8 precision, and floating point
+    tensors are cast to float16 or bfloat16 in those precisions.
+    """
+    tensor = tensor.detach().to("cpu")
+    if not tensor.is_floating_point():
+        yield name, tensor, {}
+    elif precision == "int8" and tensor.dim() > 1:
+        absmax = tensor.abs().reshape(len(tensor), -1).amax(dim=1).clamp(min=1e-12)
+        scale = (absmax / 127).float()
+        quantized = (tensor / scale.view(-1, *[1] * (tensor.dim() - 1))).round().clamp(-127, 127).to(th.int8)
+        yield name, quantized, {"scale": f"{name}.scale"}
+        yield f"{name}.scale", scale, {}
+    elif precision in ("float16", "bfloat16"):
+        yield name, tensor.to(getattr(th, precision)), {}
+    else:
+        yield name, tensor.float(), {}
+
+
+def save_model(model: th.nn.Module, spec: ModelSpec, path: str, precision: str = "float32"):
+    """
+    Writes the weights of the model into the flat file weights.bin in path. model.json holds the architecture spec and
+    the dtype, shape and byte offset of every tensor, so load_model can map the weights without unpickling anything.
+    float16 and bfloat16 halve the size of the weights, int8 stores the weight matrices in a quarter of it.
+    """
+    check_precision(precision)
+    os.makedirs(path, exist_ok=True)
+    tensors = {}
+    offset = 0
+    with open(os.path.join(path, "weights.bin"), "wb") as f:
+        for name, value in model.state_dict().items():
+            for stored_name, tensor, entry in _encode_tensor(name, value, precision):
+                dtype = str(tensor.dtype).replace("torch.", "")
+                # numpy has no bfloat16, its bits are written as int16
+                array = (tensor.view(th.int16) if tensor.dtype == th.bfloat16 else tensor).contiguous().numpy()
+                padding = -offset % MODEL_ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                f.write(array.tobytes())
+                tensors[stored_name] = dict(entry, dtype=dtype, shape=list(tensor.shape), offset=offset)
+                offset += array.nbytes
+    header = {
+        "spec": spec.to_dict(),
+        "precision": precision,
+        "state_dict": list(model.state_dict().keys()),
+        "tensors": tensors,
+    }
+    with open(os.path.join(path, "model.json"), "w") as f:
+        json.dump(header, f)
+
+
+def load_model(path: str) -> th.nn.Sequential:
+    """
+    Rebuilds a model written by save_model for inference. The weights file is memory-mapped, and the parameters of a
+    float32 artifact are views of it, so loading reads nothing and each page is read when the model first uses it.
+    float16, bfloat16 and int8 weights are converted to float32 copies while loading, which reads them in full.
+    """
+    with open(os.path.join(path, "model.json")) as f:
+        header = json.load(f)
+    # copy-on-write mapping, like the dataset tensors, so torch gets writable arrays
+    weights = np.memmap(os.path.join(path, "weights.bin"), dtype=np.uint8, mode="c")
+
+    def tensor(name: str) -> th.Tensor:
+        entry = header["tensors"][name]
+        dtype = np.dtype("int16" if entry["dtype"] == "bfloat16" else entry["dtype"])
+        size = int(np.prod(entry["shape"])) * dtype.itemsize
+        value = th.from_numpy(weights[entry["offset"]:entry["offset"] + size].view(dtype).reshape(entry["shape"]))
+        if entry["dtype"] == "bfloat16":
+            value = value.view(th.bfloat16)
+        if "scale" in entry:
+            value = value.float() * tensor(entry["scale"]).view(-1, *[1] * (value.dim() - 1))
+        return value.float()
+
+    model, _ = get_model_architecture(ModelSpec.from_dict(header["spec"]))
+    # load_state_dict would copy every tensor, and torch<2.1 has no assign=True to keep the views, so they are bound
+    # to the modules directly
+    for name in header["state_dict"]:
+        module_name, _, attribute = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        current, value = getattr(module, attribute), tensor(name)
+        if value.shape != current.shape:
+            raise ValueError(f"{name} has shape {tuple(value.shape)} in {path}, the architecture expects "
+                             f"{tuple(current.shape)}")
+        if isinstance(current, nn.Parameter):
+            value = nn.Parameter(value, requires_grad=False)
+        setattr(module, attribute, value)
+    return model
+
+
+def export_model(model: th.nn.Module, precision: str) -> FlyteDirectory:
+    path = os.path.join(current_context().working_directory, "model")
+    save_model(model, ModelSpec(), path, precision)
+    return FlyteDirectory(path)
+
+
 
 @workflow
-def mnist_workflow_cpu(n_epoch: int = 10) -> str:
+def mnist_workflow_cpu(n_epoch: int = 10, workers: int = 0, precision: str = "float32") -> ValidationMetrics:
     """Declare workflow called `wf`.
     The @dynamic decorator defines a dynamic workflow.
     Dynamic workflows allow for executing arbitrary python code, and are useful for cases where the
     workflow is not known at compile time.
 
     This particular workflow is dynamic to enable the user to choose whether to run the training on the GPU or not.
+    `workers` sets the number of data-parallel training processes, 0 starts one for every core train_cpu requests.
+    `precision` is how the trained weights are stored, one of float32, float16, bfloat16 or int8.
     """
-    training_dataset = get_dataset(training=True, gpu=False)
-    test_dataset = get_dataset(training=False, gpu=False)
-    trained_model = train_cpu(dataset=training_dataset, n_epochs=n_epoch)
-    output = validation_loss(model=trained_model, dataset=test_dataset)
+    training_dataset = get_dataset(training=True)
+    test_dataset = get_dataset(training=False)
+    trained_model = train_cpu(
+        dataset=training_dataset, loader=LoaderSpec(), n_epochs=n_epoch, workers=workers, precision=precision
+    )
+    output = validation_loss(
+        model=trained_model, dataset=test_dataset, loader=LoaderSpec(batch_size=EVAL_BATCH_SIZE, shuffle=False)
+    )
     return output
 
 
 @workflow
-def mnist_workflow_gpu(n_epoch: int = 10) -> str:
+def mnist_workflow_cpu_multinode(n_epoch: int = 10, precision: str = "float32") -> ValidationMetrics:
+    """
+    This workflow is identical to mnist_workflow_cpu, except that the training runs data-parallel on several nodes.
+    It needs the Kubeflow training operator in the cluster.
+    """
+    training_dataset = get_dataset(training=True)
+    test_dataset = get_dataset(training=False)
+    trained_model = train_cpu_multinode(
+        dataset=training_dataset, loader=LoaderSpec(), n_epochs=n_epoch, precision=precision
+    )
+    output = validation_loss(
+        model=trained_model, dataset=test_dataset, loader=LoaderSpec(batch_size=EVAL_BATCH_SIZE, shuffle=False)
+    )
+    return output
+
+
+@dynamic
+def mnist_cpu_scaling(n_epoch: int = 1, worker_counts: Optional[List[int]] = None) -> List[float]:
+    """
+    This workflow measures the CPU training throughput for every number of worker processes in worker_counts,
+    1, 2 and 4 by default. It returns the samples per second of each, in the same order.
+    """
+    if worker_counts is None:
+        worker_counts = [1, 2, 4]
+    training_dataset = get_dataset(training=True)
+    return [
+        cpu_throughput(dataset=training_dataset, loader=LoaderSpec(), n_epochs=n_epoch, workers=workers)
+        for workers in worker_counts
+    ]
+
+
+@workflow
+def mnist_workflow_gpu(n_epoch: int = 10, precision: str = "float32") -> ValidationMetrics:
     """
     This workflow is identical to the previous one, except that it runs the training on the GPU.
     """
-    training_dataset = get_dataset(training=True, gpu=True)
-    test_dataset = get_dataset(training=False, gpu=True)
-    trained_model = train_gpu(dataset=training_dataset, n_epochs=n_epoch)
-    output = validation_loss(model=trained_model, dataset=test_dataset)
+    training_dataset = get_dataset(training=True)
+    test_dataset = get_dataset(training=False)
+    trained_model = train_gpu(dataset=training_dataset, loader=LoaderSpec(), n_epochs=n_epoch, precision=precision)
+    output = validation_loss(
+        model=trained_model, dataset=test_dataset, loader=LoaderSpec(batch_size=EVAL_BATCH_SIZE, shuffle=False)
+    )
     return output
 
 
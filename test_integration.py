@@ -0,0 +1,85 @@
+"""
+Checks the registration skip logic of integration.py against a fake FlyteRemote, without a cluster:
+
+    python -m pytest -q test_integration.py
+"""
+
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+from flytekit.exceptions.user import FlyteEntityNotExistException
+
+import integration
+
+TEMPLATE = {"template_name": "hello-world", "workflow_name": "hello_world_wf"}
+
+
+class FakeFlyteRemote(object):
+    """
+    Stands in for a FlyteRemote connected to one cluster: it records raw registrations, and fetches only what was
+    registered on it.
+    """
+
+    def __init__(self, endpoint: str):
+        self.config = SimpleNamespace(platform=SimpleNamespace(endpoint=endpoint))
+        self.registrations = []
+        self.entities = set()
+
+    def raw_register(self, cp_entity, settings, version, create_default_launchplan=True):
+        self.registrations.append((cp_entity, version))
+        self.entities.add(version)
+
+    def fetch_workflow(self, project, domain, name, version):
+        if version not in self.entities:
+            raise FlyteEntityNotExistException(f"{project}/{domain}/{name}@{version} does not exist")
+        return SimpleNamespace(id=SimpleNamespace(project=project, domain=domain, name=name, version=version))
+
+    fetch_task = fetch_workflow
+
+
+@pytest.fixture(autouse=True)
+def serialize_without_imports(monkeypatch):
+    # the skip logic does not depend on what is serialized, so the template is never imported
+    def serialize_template(template_name, workflow_name, settings):
+        return {"type": "workflow", "name": f"workflows.{workflow_name}", "entities": OrderedDict(x="entity"),
+                "import_seconds": 0.0, "serialize_seconds": 0.0}
+
+    monkeypatch.setattr(integration, "serialize_template", serialize_template)
+
+
+def register(remote: FakeFlyteRemote, manifest: dict):
+    return integration.register_template(remote, TEMPLATE, "ghcr.io/flyteorg/flytekit-python-template", "latest",
+                                         manifest=manifest)
+
+
+def test_unchanged_template_is_skipped():
+    remote, manifest = FakeFlyteRemote("dns:///a.example.com"), {}
+    first = register(remote, manifest)
+    second = register(remote, manifest)
+    assert len(remote.registrations) == 1
+    assert second.id == first.id
+
+
+def test_manifest_of_another_cluster_is_not_used():
+    manifest = {}
+    register(FakeFlyteRemote("dns:///a.example.com"), manifest)
+    other = FakeFlyteRemote("dns:///b.example.com")
+    register(other, manifest)
+    assert len(other.registrations) == 1
+    assert len(manifest) == 2
+
+
+def test_entity_missing_from_the_cluster_is_registered_again():
+    manifest = {}
+    register(FakeFlyteRemote("dns:///a.example.com"), manifest)
+    # the same cluster after a reset
+    reset = FakeFlyteRemote("dns:///a.example.com")
+    register(reset, manifest)
+    assert len(reset.registrations) == 1
+
+
+def test_unexpected_entity_type_fails_the_shard():
+    # the fake serialization returns a str entity, which has no idl form to hand back to the registering process
+    with pytest.raises(TypeError):
+        integration.serialize_template_shard([TEMPLATE], "ghcr.io/flyteorg/flytekit-python-template", "latest", "v1")